@@ -1003,23 +1003,54 @@ def _generate_conversion_script_text(cfg: Dict[str, Any]) -> str:
 # ------------------------------
 
 def _runs_index_path(root: str) -> str:
+    # One JSON record per line so new runs are appended without rewriting history
+    return os.path.join(_ingestion_dir(root), "conversions.jsonl")
+
+
+def _legacy_runs_index_path(root: str) -> str:
     return os.path.join(_ingestion_dir(root), "conversions.json")
 
 
 def _load_runs(root: str) -> List[Dict[str, Any]]:
-    data = _read_json(_runs_index_path(root))
-    return data if isinstance(data, list) else []
+    path = _runs_index_path(root)
+    if not os.path.exists(path):
+        data = _read_json(_legacy_runs_index_path(root))
+        return data if isinstance(data, list) else []
+    runs: List[Dict[str, Any]] = []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    runs.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Skip a partially written line (e.g., interrupted append)
+                    continue
+    except Exception:
+        return []
+    return runs
 
 
 def _save_runs(root: str, runs: List[Dict[str, Any]]) -> None:
     _ensure_dir(_ingestion_dir(root))
-    _save_json(_runs_index_path(root), runs)
+    path = _runs_index_path(root)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for run in runs:
+            f.write(json.dumps(run) + "\n")
+    os.replace(tmp_path, path)
 
 
 def _append_run(root: str, run: Dict[str, Any]) -> None:
-    runs = _load_runs(root)
-    runs.append(run)
-    _save_runs(root, runs)
+    path = _runs_index_path(root)
+    if not os.path.exists(path) and os.path.exists(_legacy_runs_index_path(root)):
+        # Migrate the old JSON list once; later appends are O(1)
+        _save_runs(root, _load_runs(root))
+    _ensure_dir(_ingestion_dir(root))
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(run) + "\n")
 
 
 def _delete_run(root: str, idx: int) -> None:
@@ -3137,7 +3168,7 @@ def main() -> None:
         return
 
     if mode == "runs":
-        import glob
+        import fnmatch
         import pandas as pd
 
         st.header("Conversion runs")
@@ -3150,18 +3181,25 @@ def main() -> None:
         ds_cfg = _load_dataset_yaml(root)
         persisted_template = ds_cfg.get("session_registry_template") if isinstance(ds_cfg, dict) else None
 
-        def _detect_latest_template(r: str) -> str | None:
-            candidates: List[str] = []
-            for ext in ("csv", "xlsx", "xls"):
-                candidates.extend(glob.glob(os.path.join(r, f"*recordings*.{ext}")))
+        # List the project root once per rerun; all patterns below match against this listing
+        try:
+            with os.scandir(root) as it:
+                root_entries = [e for e in it if not e.name.startswith(".")]
+        except OSError:
+            root_entries = []
+
+        def _detect_latest_template(entries: List[os.DirEntry]) -> str | None:
+            candidates = [
+                e for e in entries
+                if any(fnmatch.fnmatch(e.name, f"*recordings*.{ext}") for ext in ("csv", "xlsx", "xls"))
+            ]
             if not candidates:
                 return None
-            candidates.sort(key=lambda p: os.path.getmtime(p), reverse=True)
-            return candidates[0]
+            return max(candidates, key=lambda e: e.stat().st_mtime).path
 
-        latest_auto = _detect_latest_template(root)
+        latest_auto = _detect_latest_template(root_entries)
         # Build dropdown list: persisted + any xlsx/csv in root
-        root_files = [p for p in glob.glob(os.path.join(root, "*.xlsx")) + glob.glob(os.path.join(root, "*.csv"))]
+        root_files = [e.path for e in root_entries if fnmatch.fnmatch(e.name, "*.xlsx") or fnmatch.fnmatch(e.name, "*.csv")]
         # Deduplicate while preserving order
         seen: Set[str] = set()
         session_file_options: List[str] = []
@@ -3367,7 +3405,8 @@ def main() -> None:
                     else:
                         st.error(f"Conversion {status}. See log.")
 
-        return
+        # Run history
+        st.subheader("Run history")
         runs = _load_runs(root)
         if not runs:
             st.caption("No runs recorded yet.")
@@ -3377,26 +3416,39 @@ def main() -> None:
         for i, r in enumerate(reversed(runs)):
             idx = len(runs) - 1 - i
             with st.expander(f"{r.get('session_id','')} · {r.get('timestamp','')} · {r.get('status','')}"):
+                log_path = r.get("log", "")
                 st.write("Script:", r.get("script", ""))
-                st.write("Log:", r.get("log", ""))
-                # Log preview
+                st.write("Log:", log_path)
+                # Stat the log once; reused by the preview and the download button
+                try:
+                    log_size = os.path.getsize(log_path) if log_path else None
+                except OSError:
+                    log_size = None
+                # Log preview: read only the tail (32 KiB holds the last 8000 chars even at 4 bytes/char)
                 try:
-                    if os.path.exists(r.get("log", "")):
-                        with open(r["log"], "r", encoding="utf-8", errors="ignore") as f:
-                            content = f.read()
-                        st.text_area("Log content", value=content[-8000:], height=200)
+                    if log_size is not None:
+                        with open(log_path, "rb") as f:
+                            f.seek(max(0, log_size - 32768))
+                            content = f.read().decode("utf-8", errors="ignore")
+                        st.text_area("Log content", value=content[-8000:], height=200, key=f"log_content_{idx}")
                 except Exception:
                     pass
                 c1, c2 = st.columns(2)
                 with c1:
                     if st.button("Delete run", key=f"del_run_{idx}"):
                         _delete_run(root, idx)
-                        st.experimental_rerun()
+                        try:
+                            st.rerun()
+                        except Exception:
+                            st.experimental_rerun()
                 with c2:
-                    if os.path.exists(r.get("log", "")):
-                        with open(r["log"], "r", encoding="utf-8", errors="ignore") as f:
-                            log_bytes = f.read().encode("utf-8", errors="ignore")
-                        st.download_button("Download log", data=log_bytes, file_name=os.path.basename(r["log"]))
+                    if log_size is not None:
+                        # Hand Streamlit the open file instead of a decoded copy; skip oversized logs
+                        if log_size < 25 * 1024 * 1024:
+                            with open(log_path, "rb") as f:
+                                st.download_button("Download log", data=f, file_name=os.path.basename(log_path), key=f"dl_log_{idx}")
+                        else:
+                            st.caption(f"Log too large to download inline ({log_size // (1 << 20)} MB). Path: {log_path}")
         return
 
     if mode == "neurosift":
@@ -3447,33 +3499,31 @@ def main() -> None:
                 else:
                     hint = " If this is Windows, this may be due to symlink privilege. Try running a Terminal as Administrator or enable Developer Mode; alternatively, ensure your Neurosift version supports --no-symlink."
                     st.error("Failed to launch Neurosift." + (f" Details: {last_err}" if last_err else "") + hint)
-        return
-
         # Troubleshooting tools
-        st.subheader("Troubleshooting")
-        if st.button("Test Neurosift CLI", key="test_neurosift_cli"):
-            import shutil, sys
-            ns_path = shutil.which("neurosift")
-            st.write("neurosift on PATH:", ns_path or "(not found)")
-            st.write("Python executable:", sys.executable)
-            # Version
-            try:
-                resv = subprocess.run(["neurosift", "--version"], capture_output=True, text=True)
-                st.write("--version rc=", resv.returncode)
-                st.code((resv.stdout or resv.stderr)[:2000])
-            except Exception as e:
-                st.warning(f"Failed to run 'neurosift --version': {e}")
-            # Help for view-nwb
-            try:
-                resh = subprocess.run(["neurosift", "view-nwb", "--help"], capture_output=True, text=True)
-                st.write("view-nwb --help rc=", resh.returncode)
-                st.code((resh.stdout or resh.stderr)[:4000])
-                if "--no-symlink" in (resh.stdout or ""):
-                    st.info("Detected support for --no-symlink.")
-                else:
-                    st.info("--no-symlink not detected in help output; your version may not support it.")
-            except Exception as e:
-                st.warning(f"Failed to run 'neurosift view-nwb --help': {e}")
+        with st.expander("Troubleshooting"):
+            if st.button("Test Neurosift CLI", key="test_neurosift_cli"):
+                import shutil
+                ns_path = shutil.which("neurosift")
+                st.write("neurosift on PATH:", ns_path or "(not found)")
+                st.write("Python executable:", sys.executable)
+                # Version
+                try:
+                    resv = subprocess.run(["neurosift", "--version"], capture_output=True, text=True)
+                    st.write("--version rc=", resv.returncode)
+                    st.code((resv.stdout or resv.stderr)[:2000])
+                except Exception as e:
+                    st.warning(f"Failed to run 'neurosift --version': {e}")
+                # Help for view-nwb
+                try:
+                    resh = subprocess.run(["neurosift", "view-nwb", "--help"], capture_output=True, text=True)
+                    st.write("view-nwb --help rc=", resh.returncode)
+                    st.code((resh.stdout or resh.stderr)[:4000])
+                    if "--no-symlink" in (resh.stdout or ""):
+                        st.info("Detected support for --no-symlink.")
+                    else:
+                        st.info("--no-symlink not detected in help output; your version may not support it.")
+                except Exception as e:
+                    st.warning(f"Failed to run 'neurosift view-nwb --help': {e}")
 
 
 if __name__ == "__main__":
@@ -6,12 +6,11 @@
 import os, sys
 import re
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
-from datetime import datetime
-from dateutil.tz import tzlocal
 from pathlib import Path
 import glob
-import uuid
+import secrets
 import h5py
 import numpy as np
 
@@ -20,14 +19,16 @@ from pynwb.ophys import (
     OpticalChannel,
     TwoPhotonSeries,
 )
-from hdmf.data_utils import DataChunkIterator
+try:
+    import hdf5plugin #OPTIONAL; REGISTERS BITSHUFFLE/LZ4 FILTERS WITH HDF5
+except ModuleNotFoundError:
+    hdf5plugin = None
 
-parent = Path(__file__).parents[1] #2 levels up
-sys.path.append(parent)
+parent = Path(__file__).parents[1] #2 levels up (REPOSITORY ROOT; lib/ IS A PACKAGE)
+sys.path.insert(0, str(parent)) #sys.path ENTRIES MUST BE str; ROOT-RELATIVE SO IMPORTS DO NOT DEPEND ON CWD
 print(f'USING PARENT PATH REFERENCES FOR IMPORTS: {parent}')
 
-sys.path.insert(1, 'lib')
-import utils
+from lib import utils
 
 
 
@@ -42,6 +43,17 @@ researcher_experimenter = ""
 institution = "UCSD"
 performance_lab = 'Kleinfeld Lab'
 debug = True
+h5_cache_bytes = 128 * 1024 * 1024 #HDF5 RAW CHUNK CACHE (BYTES) FOR OUTPUT FILES
+h5_cache_slots = 521 #PRIME; HASH SLOTS FOR CHUNK CACHE
+h5_page_size = 4 * 1024 * 1024 #PAGED FILE SPACE STRATEGY; COLOCATES METADATA FOR CLOUD (S3/DANDI) RANGE READS
+source_buffer_gb = 1.0 #MAX SOURCE READ BUFFER (WHOLE SOURCE CHUNKS) PER WORKER PER ITERATION OF THE H5 -> NWB COPY
+source_buffer_total_gb = 4.0 #SOURCE READ BUFFER BUDGET SHARED BY ALL WORKERS (PER-WORKER BUFFER = BUDGET / WORKERS, CAPPED ABOVE)
+source_buffer_min_gb = 0.125 #FLOOR; A BUFFER MUST STILL HOLD AT LEAST ONE SOURCE CHUNK
+#BITSHUFFLE+LZ4 COMPRESSES INTEGER IMAGE DATA MUCH FASTER THAN GZIP; FALL BACK TO LZF (BUILT INTO h5py) IF hdf5plugin NOT INSTALLED
+if hdf5plugin is not None:
+    h5_compression = dict(hdf5plugin.Bitshuffle(cname='lz4'), allow_plugin_filters=True)
+else:
+    h5_compression = dict(compression='lzf', shuffle=True)
 #################################################################
 
 
@@ -63,6 +75,7 @@ def collectArguments():
     argParser.add_argument("-researcher", "--researcher_experimenter", help="Name(s) of researcher/experimenter", default=researcher_experimenter)
     argParser.add_argument("-institution", "--institution", help="Name of institution", default=institution)
     argParser.add_argument("-debug", "--debug", help="Display debug information", default=False)
+    argParser.add_argument("-workers", "--workers", help="Number of sessions converted in parallel (default: half the CPU cores)", type=int, default=max(1, (os.cpu_count() or 1) // 2))
     args = argParser.parse_args()
     return args
 
@@ -93,10 +106,16 @@ def load_data(input_file, experiment_modality):
                     'src_folder_directory',
                     'experimenters',
                     'institution',
-                    'identifier'
+                    'identifier',
+                    #READ BY THE CONVERSION LOOP
+                    'session_start_time(YYYY-MM-DD HH:MM)',
+                    'age(days)',
+                    'performance_lab',
+                    'recordings_folder_directory',
+                    'analysis_file'
                     ]
     
-    if experiment_modality == "3":#2photon
+    if str(experiment_modality) == "3":#2photon (CLI PASSES A STRING; THE DEFAULT IS AN int)
         exp_modality_specific_fields = [
             'stimulus_notes_include',
             'stimulus_notes_paradigm',
@@ -125,141 +144,102 @@ def load_data(input_file, experiment_modality):
     #APPEND EXPERIMENT MODALITY SPECFIC FIELDS TO COMMON LIST
     lstNWBFields = commonFields + exp_modality_specific_fields
 
-    matched_fields = []
-    try:
-        lstExtractionFields = pd.read_excel(input_file, sheet_name="auto", usecols=lstNWBFields) #just extract columns/fields I need
-        matched_fields = lstNWBFields
-    except ValueError:
-        lstExtractionFields = pd.read_excel(input_file, sheet_name="auto")  # read fine 'as is'
-
-        fields_in_file = lstExtractionFields.columns.tolist()
-        matched_fields = list(set(fields_in_file).intersection(lstNWBFields))
-
-        print(f"IMPORT WARNING [SOME FIELDS NOT MATCHED] - NWB FIELD COUNT {len(lstNWBFields)}; IMPORT SHEET FIELD COUNT {len(fields_in_file)}")
-    finally:
+    #ONE PARSE: COLUMNS ARE FILTERED BY SET MEMBERSHIP WHILE READING, SO MISSING FIELDS NO LONGER TRIGGER A SECOND FULL PARSE
+    nwb_fields = frozenset(lstNWBFields)
+    try: #calamine (RUST) PARSER IS MUCH FASTER THAN openpyxl FOR VALUE-ONLY READS
+        lstExtractionFields = pd.read_excel(input_file, sheet_name="auto", usecols=lambda field: field in nwb_fields, engine="calamine")
+    except ImportError: #python-calamine IS OPTIONAL
+        lstExtractionFields = pd.read_excel(input_file, sheet_name="auto", usecols=lambda field: field in nwb_fields)
+    matched_fields = lstExtractionFields.columns.tolist() #KEEPS SHEET COLUMN ORDER
+    if len(matched_fields) < len(lstNWBFields):
+        print(f"IMPORT WARNING [SOME FIELDS NOT MATCHED] - NWB FIELD COUNT {len(lstNWBFields)}; MATCHED FIELD COUNT {len(matched_fields)}")
+
+    if debug:
         print(f"SCRIPT WILL CONTINUE WITH THE FOLLOWING FIELDS: {matched_fields}")
         print("*" * 40)
 
     return lstExtractionFields
     
 
-def main():
-    displayMenu()
-    if len(sys.argv) > 1:
-        args = collectArguments()
-        print("USING CLI ARGUMENTS")
-    else:
-        print("MISSING ARGUMENTS; USING DEFAULTS")
-        print(f'\'python {os.path.basename(__file__)} -h\' FOR HELP\n')
-        args.output_path = output_path
-        args.experiment_modality = experiment_modality
-        args.researcher_experimenter = researcher_experimenter
-        args.institution = institution
-        args.debug = debug
-    
-    lstRecords = load_data(args.input_file, args.experiment_modality)
-    cnt_sessions = lstRecords['session_id'].notna().sum()
-    displayParam(args, cnt_sessions)
+def process_session(cnt, row, output_dir, buffer_gb=source_buffer_gb):
+    '''Converts one session (row of the meta-data sheet, as a plain dict) to NWB; runs in a worker process'''
+    print(f"PROCESSING DATASET #{cnt + 1}")
+    unique_identifier = secrets.token_hex(16)
+    session_id = str(row['session_id']) + "_" + unique_identifier
+
+    session_start_time = row['session_start_time']
 
     ##################################################################################
-    #RENAME EXCEL/DATAFRAME FIELD COLUMN NAMES FOR EASIER NWB CONVERSION
-    lstRecords.rename(columns={'session_start_time(YYYY-MM-DD HH:MM)': 'session_start_time'}, inplace=True)
-    lstRecords.rename(columns={'date_of_birth(YYYY-MM-DD)': 'date_of_birth'}, inplace=True)
-    lstRecords.rename(columns={'age(days)': 'age_days'}, inplace=True)
+    # CREATE EXPERIMENTAL SUBJECT OBJECT
+    age = row['age_days']
+    subject_description = row['subject_description']
+    genotype = row['genotype']
+    sex = row['sex']
+    subject_id = row['subject_id']
+    subject_weight = row['subject_weight']
+    date_of_birth = row['date_of_birth']
+    subject_strain = row['subject_strain']
+    species = row['species']
+
+    subject = utils.get_subject(age,
+                                subject_description,
+                                genotype,
+                                sex,
+                                species,
+                                subject_id,
+                                subject_weight,
+                                date_of_birth,
+                                subject_strain)
     ##################################################################################
 
-    for cnt, row in enumerate(lstRecords.itertuples(index=False)):
-        if pd.isna(row.session_id) or str(row.session_id) == '':
-            continue
-        print(f"PROCESSING DATASET #{cnt + 1}")
-        unique_identifier = str(uuid.uuid4())            
-        session_id = str(row.session_id) + "_" + unique_identifier
-
-        session_start_time = row.session_start_time
-
-        if isinstance(session_start_time, pd.Timestamp):
-            if pd.isna(session_start_time):
-                session_start_time = datetime.now(tzlocal())
-            elif session_start_time.tzinfo is None:
-                session_start_time = session_start_time.tz_localize(tzlocal())
-        elif isinstance(session_start_time, str):
-            if not session_start_time:
-                session_start_time = datetime.now(tzlocal())
-            else:
-                session_start_time = pd.to_datetime(session_start_time)
-            if session_start_time.tzinfo is None:
-                session_start_time = session_start_time.tz_localize(tzlocal())
-
-        ##################################################################################
-        # CREATE EXPERIMENTAL SUBJECT OBJECT
-        age = row.age_days
-        subject_description = row.subject_description
-        genotype = row.genotype
-        sex = row.sex
-        subject_id = row.subject_id
-        subject_weight = row.subject_weight
-        date_of_birth = row.date_of_birth
-        subject_strain = row.subject_strain
-        species = row.species
-
-        subject = utils.get_subject(age,
-                                    subject_description,
-                                    genotype,
-                                    sex,
-                                    species,
-                                    subject_id,
-                                    subject_weight,
-                                    date_of_birth,
-                                    subject_strain)
-        ##################################################################################
-
-        keywords = ['Researcher(s): ' + str(row.experimenters)]
-        institution = row.institution
-        performance_lab = row.performance_lab
-        session_description = row.session_description
-        researcher_experimenter = row.experimenters
-        
-        nwbfile = NWBFile(
-                session_description=str(session_description),
-                identifier=session_id,
-                session_start_time=session_start_time,
-                keywords = keywords,
-                experimenter = researcher_experimenter,
-                institution = institution,
-                lab = performance_lab,
-                subject=subject
-            )
-
-
-        ##################################################################################
-        # CONVERT H5 FILE TO NWB
-        ##################################################################################
-        data_src = Path(str(row.recordings_folder_directory), str(row.analysis_file))
-        if debug:
-            print(f'DEBUG: Converting file to NWB: {data_src}')
-
-        output_file = Path(args.output_path, Path(data_src).stem + '.nwb')
-        output_file.parent.mkdir(parents=True, exist_ok=True)
+    keywords = ['Researcher(s): ' + str(row['experimenters'])]
+    institution = row['institution']
+    performance_lab = row['performance_lab']
+    session_description = row['session_description']
+    researcher_experimenter = row['experimenters']
+    
+    nwbfile = NWBFile(
+            session_description=str(session_description),
+            identifier=session_id,
+            session_start_time=session_start_time,
+            keywords = keywords,
+            experimenter = researcher_experimenter,
+            institution = institution,
+            lab = performance_lab,
+            subject=subject
+        )
 
-        # data_io = np.ones((1000, 100, 100)) #for testing
-          
-        #VERIFY DATA CONTAINER NAME, IF DIFFERENT FROM 'data'
-        # with h5py.File(data_src, 'r') as fh:
-        #     print("Available datasets:", list(fh.keys()))
-        #     data = fh['data'][:]
 
-        with h5py.File(data_src, 'r') as fh:
-            dataset = fh['data']
-            chunk_iter = DataChunkIterator(dataset, buffer_size=2000)
-            data_io = H5DataIO(chunk_iter, compression='gzip')
+    ##################################################################################
+    # CONVERT H5 FILE TO NWB
+    ##################################################################################
+    data_src = Path(str(row['recordings_folder_directory']), str(row['analysis_file']))
+    if debug:
+        print(f'DEBUG: Converting file to NWB: {data_src}')
+
+    output_file = output_dir / f'{data_src.stem}.nwb'
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+
+    # data_io = np.ones((1000, 100, 100)) #for testing
+      
+    #VERIFY DATA CONTAINER NAME, IF DIFFERENT FROM 'data'
+    # with h5py.File(data_src, 'r') as fh:
+    #     print("Available datasets:", list(fh.keys()))
+    #     data = fh['data'][:]
+
+    #SOURCE STAYS OPEN UNTIL THE NWB WRITE HAS PULLED EVERY BUFFER (CLOSED ON ANY EXCEPTION TOO)
+    with h5py.File(data_src, 'r') as fh:
+        dataset = fh['data']
+        chunk_iter = utils.H5DatasetChunkIterator(dataset, buffer_gb=buffer_gb, display_progress=debug)
+        data_io = H5DataIO(chunk_iter, chunks=chunk_iter.chunk_shape, **h5_compression) #EXPLICIT CHUNKS; NO HDMF RE-CHUNKING
 
         ##################################################################################
         #ADD 2PHOTON IMAGEING ACQUISITION META-DATA
         ##################################################################################
         device = nwbfile.create_device(
-            name=str(row.device_name),
-            description=str(row.device_description),
-            manufacturer=str(row.device_manufacturer),
+            name=str(row['device_name']),
+            description=str(row['device_description']),
+            manufacturer=str(row['device_manufacturer']),
             model_number="",
             model_name="",
             serial_number="",
@@ -298,14 +278,65 @@ def main():
                 unit="a.u.",
             )
         nwbfile.add_acquisition(two_p_series)
-        
+    
         if debug:
             print(f'DEBUG: Output file path: {output_file}')
-        with NWBHDF5IO(output_file, 'w') as io:
-            io.write(nwbfile)
+        #OPEN OUTPUT WITH LATEST FILE FORMAT (V2 B-TREES) AND A LARGER CHUNK CACHE; NWBHDF5IO WRITES THROUGH THE HANDLE
+        with h5py.File(output_file, 'w', libver='latest', rdcc_nbytes=h5_cache_bytes, rdcc_nslots=h5_cache_slots,
+                       fs_strategy='page', fs_page_size=h5_page_size) as h5_out:
+            with NWBHDF5IO(mode='w', file=h5_out) as io:
+                io.write(nwbfile, cache_spec=True)
+
+    print(f"Conversion completed. NWB file saved to {output_file}")
+    return output_file
+
+
+def main():
+    displayMenu()
+    if len(sys.argv) > 1:
+        args = collectArguments()
+        print("USING CLI ARGUMENTS")
+    else:
+        print("MISSING ARGUMENTS; USING DEFAULTS")
+        print(f'\'python {os.path.basename(__file__)} -h\' FOR HELP\n')
+        args.output_path = output_path
+        args.experiment_modality = experiment_modality
+        args.researcher_experimenter = researcher_experimenter
+        args.institution = institution
+        args.debug = debug
+    
+    lstRecords = load_data(args.input_file, args.experiment_modality)
+    cnt_sessions = lstRecords['session_id'].notna().sum()
+    displayParam(args, cnt_sessions)
+
+    ##################################################################################
+    #RENAME EXCEL/DATAFRAME FIELD COLUMN NAMES FOR EASIER NWB CONVERSION
+    lstRecords.rename(columns={'session_start_time(YYYY-MM-DD HH:MM)': 'session_start_time'}, inplace=True)
+    lstRecords.rename(columns={'date_of_birth(YYYY-MM-DD)': 'date_of_birth'}, inplace=True)
+    lstRecords.rename(columns={'age(days)': 'age_days'}, inplace=True)
+    ##################################################################################
+
+    #NORMALIZE SESSION START TIMES ONCE (COLUMN-WISE); NO TIMEZONE -> LOCAL, MISSING/UNPARSABLE -> NOW
+    session_start_times = pd.to_datetime(lstRecords['session_start_time'], errors='coerce')
+    if session_start_times.dt.tz is None:
+        session_start_times = session_start_times.dt.tz_localize(utils.local_tz, nonexistent='shift_forward', ambiguous='NaT')
+    lstRecords['session_start_time'] = session_start_times.fillna(pd.Timestamp.now(tz=utils.local_tz))
+
+    output_dir = Path(args.output_path)
+
+    #SESSIONS ARE INDEPENDENT (ONE .nwb FILE EACH) AND COMPRESSION-BOUND; CONVERT THEM IN PARALLEL, ONE PROCESS PER SESSION
+    sessions = [(cnt, row) for cnt, row in enumerate(lstRecords.to_dict('records')) #PLAIN DICTS PICKLE CLEANLY
+                if not (pd.isna(row['session_id']) or str(row['session_id']) == '')]
+    max_workers = max(1, min(args.workers, len(sessions)))
+    #EVERY WORKER HOLDS A SOURCE READ BUFFER AND AN OUTPUT CHUNK CACHE; SPLIT THE BUFFER BUDGET SO MEMORY DOES NOT SCALE WITH WORKERS
+    buffer_gb = max(source_buffer_min_gb, min(source_buffer_gb, source_buffer_total_gb / max_workers))
+    print(f"WORKERS: {max_workers}; SOURCE BUFFER PER WORKER: {buffer_gb:.3f} GiB; "
+          f"ESTIMATED PEAK (BUFFERS + CHUNK CACHES): {max_workers * (buffer_gb + h5_cache_bytes / 1024**3):.2f} GiB")
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(process_session, cnt, row, output_dir, buffer_gb) for cnt, row in sessions]
+        for future in futures:
+            future.result() #RE-RAISE ANY WORKER EXCEPTION IN THE PARENT
 
-        print(f"Conversion completed. NWB file saved to {output_file}")
-        
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
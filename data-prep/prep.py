@@ -4,33 +4,35 @@
 
 '''TERMINAL CONVERSION SCRIPT FOR MULTIPLE EXPERIMENTAL MODALITIES'''
 
-import os, sys, math, pynwb, re, glob
+import os, sys, math, pynwb, re, fnmatch
 
 from pathlib import Path, PurePath
+from collections import defaultdict
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from types import SimpleNamespace
 import argparse
 import pandas as pd
 import numpy as np
-import uuid
-from datetime import datetime
-from dateutil.tz import tzlocal
+import openpyxl
 from scipy.io import loadmat
 import h5py
 
 from pynwb import NWBHDF5IO, NWBFile
 from pynwb.image import ImageSeries
 
-parent = Path(__file__).parents[1] #2 levels up
-sys.path.append(parent)
+parent = Path(__file__).parents[1] #2 levels up (REPOSITORY ROOT; lib/ AND converters/ ARE PACKAGES)
+sys.path.insert(0, str(parent)) #sys.path ENTRIES MUST BE str; ROOT-RELATIVE SO IMPORTS DO NOT DEPEND ON CWD
 print("*"*40)
 print(f'USING PARENT PATH REFERENCES FOR IMPORTS: {parent}')
 print("*"*40)
-sys.path.insert(1, 'lib')
-sys.path.insert(1, 'converters')
 
-import utils
-import behavior
-import ephys
-from ConvertIntanToNWB import convert_to_nwb
+from lib import utils, behavior, ephys
+from converters.ConvertIntanToNWB import convert_to_nwb
+try:
+    from hdmf_zarr.nwb import NWBZarrIO #OPTIONAL; ONLY NEEDED FOR --backend zarr
+except ModuleNotFoundError:
+    NWBZarrIO = None
 
 #################################################################
 # APP CONSTANTS (DEFAULT)
@@ -38,6 +40,25 @@ output_path = Path(os.getcwd(), 'output')
 experiment_description = None #string or null
 scratch_path = Path('/', 'data', 'nwb_tmp')
 debug = True
+electrode_mapping_pattern = re.compile(r'\{([^{}]*)\}') #CONTENT BETWEEN CURLY BRACES; NEGATED CLASS AVOIDS BACKTRACKING
+intan_samples_per_block = 128 #RHD DATA BLOCK LENGTH (SAMPLES PER CHANNEL)
+target_chunk_bytes = 1024 * 1024 #~1 MiB HDF5 CHUNKS (ALL CHANNELS x T SAMPLES)
+h5_cache_bytes = 64 * 1024 * 1024 #HDF5 RAW CHUNK CACHE (BYTES) FOR OUTPUT FILES
+h5_cache_slots = 100003 #PRIME; HASH SLOTS FOR CHUNK CACHE
+h5_page_size = 4 * 1024 * 1024 #PAGED FILE SPACE STRATEGY; COLOCATES METADATA FOR CLOUD (S3/DANDI) RANGE READS
+prefetch_workers = 4 #THREADS READING A BEHAVIOR SESSION'S INDEPENDENT FILES (ELLIPSE, EXCEL, 36data, LCmat)
+filename_sanitize_table = str.maketrans({'/': '_', '\\': '_', ':': '_'}) #PATH SEPARATORS (AND WINDOWS DRIVE COLON) -> UNDERSCORE
+#SESSION FILE NAME PATTERNS (AFTER THE '<session>_' PREFIX); COMPILED ONCE, SHARED BY ALL ROWS
+#CASE-INSENSITIVE ON WINDOWS, AS fnmatch.filter/glob.glob ARE THERE (X_cam.AVI MATCHES *.avi)
+session_file_flags = re.IGNORECASE if os.name == 'nt' else 0
+session_file_patterns = {
+    'video': re.compile(fnmatch.translate('*.avi'), session_file_flags),
+    'torso': re.compile(fnmatch.translate('*_*_torso.csv'), session_file_flags),
+    'ellipse': re.compile(fnmatch.translate('*_ellipse_*.mat'), session_file_flags),
+    'excel': re.compile(fnmatch.translate('*_excel.xlsx'), session_file_flags),
+    '36data': re.compile(fnmatch.translate('*_36data.mat'), session_file_flags),
+    'LCmat': re.compile(fnmatch.translate('*_LCmat.mat'), session_file_flags),
+}
 #################################################################
 
 
@@ -58,6 +79,10 @@ def collectArguments():
     argParser.add_argument("-researcher", "--researcher_experimenter", help="Name(s) of researcher/experimenter")
     argParser.add_argument("-institution", "--institution", help="Name of institution")
     argParser.add_argument("-debug", "--debug", help="Display debug information", default=False)
+    argParser.add_argument("-workers", "--workers", help="Number of sessions converted in parallel (default: half the CPU cores)", type=int, default=max(1, (os.cpu_count() or 1) // 2))
+    argParser.add_argument("-backend", "--backend", help="Storage backend for behavior NWB output (zarr requires hdmf-zarr)", choices=['hdf5', 'zarr'], default='hdf5')
+    argParser.add_argument("-compressor", "--compressor", help="Compression for large behavior time series and matrices (36data, LCmat, processing/analysis); HDF5 filter or equivalent Zarr codec (lzf: hdf5 only)", choices=['gzip', 'blosc', 'zstd', 'lzf', 'none'], default='blosc')
+    argParser.add_argument("-force", "--force", help="Rewrite behavior NWB outputs even when they are newer than all of their inputs", action="store_true")
     args = argParser.parse_args()
     return args
 
@@ -104,6 +129,27 @@ def displayParam(args):
     return args.input_file
 
 
+def load_sheet(input_file):
+    '''Reads the "auto" sheet of the meta-data workbook, using a Parquet cache keyed on the workbook mtime'''
+    cache_file = Path(input_file).with_suffix('.parquet')
+    if cache_file.exists() and cache_file.stat().st_mtime >= Path(input_file).stat().st_mtime:
+        print(f'READING CACHED META-DATA: {cache_file}')
+        return pd.read_parquet(cache_file)
+
+    try:
+        sheet = pd.read_excel(input_file, sheet_name="auto", engine="calamine",
+                              dtype={'stimulus_notes_file': str, 'notes_file': str})
+    except ImportError: #python-calamine IS OPTIONAL; FALL BACK TO THE DEFAULT (openpyxl) ENGINE
+        sheet = pd.read_excel(input_file, sheet_name="auto",
+                              dtype={'stimulus_notes_file': str, 'notes_file': str})
+    try:
+        sheet.to_parquet(cache_file, compression='zstd')
+    except Exception as e: #CACHE IS BEST-EFFORT (E.G. pyarrow MISSING, MIXED-TYPE COLUMNS, READ-ONLY FOLDER)
+        print(f'WARNING: UNABLE TO CACHE META-DATA ({e})')
+        cache_file.unlink(missing_ok=True)
+    return sheet
+
+
 def load_data(input_file, experiment_modality):
     '''Used for meta-data loading'''
 
@@ -202,16 +248,19 @@ def load_data(input_file, experiment_modality):
     #APPEND EXPERIMENT MODALITY SPECFIC FIELDS TO COMMON LIST
     lstNWBFields = commonFields + exp_modality_specific_fields
     
+    #PARSED SHEET IS CACHED AS PARQUET NEXT TO THE .xlsx AND REUSED UNTIL THE WORKBOOK IS MODIFIED
+    #calamine (RUST) PARSER IS MUCH FASTER THAN openpyxl FOR VALUE-ONLY READS
+    sheet = load_sheet(input_file)
+    fields_in_file = sheet.columns.tolist()
     matched_fields = []
-    try:
-        lstExtractionFields = pd.read_excel(input_file, sheet_name="auto", usecols=lstNWBFields,
-                                            dtype={'stimulus_notes_file': str, 'notes_file': str}) #just extract columns/fields I need
+    if set(lstNWBFields).issubset(fields_in_file):
+        lstExtractionFields = sheet[list(dict.fromkeys(lstNWBFields))] #just extract columns/fields I need (SOME FIELDS ARE LISTED TWICE)
         matched_fields = lstNWBFields
-    except ValueError:
+    else:
         # Read all columns, then force string conversion for critical fields
-        lstExtractionFields = pd.read_excel(input_file, sheet_name="auto")
-        fields_in_file = lstExtractionFields.columns.tolist()
-        matched_fields = list(set(fields_in_file).intersection(lstNWBFields))
+        lstExtractionFields = sheet
+        nwb_fields = frozenset(lstNWBFields)
+        matched_fields = [field for field in fields_in_file if field in nwb_fields] #KEEPS SHEET COLUMN ORDER
         
         # Ensure critical columns are strings even if not in lstNWBFields
         for col in ['stimulus_notes_file', 'notes_file']:
@@ -219,34 +268,53 @@ def load_data(input_file, experiment_modality):
                 lstExtractionFields[col] = lstExtractionFields[col].astype(str)
 
         print(f"IMPORT WARNING [SOME FIELDS NOT MATCHED] - NWB FIELD COUNT {len(lstNWBFields)}; IMPORT SHEET FIELD COUNT {len(fields_in_file)}")
-    finally:
+    if debug:
         print(f"SCRIPT WILL CONTINUE WITH THE FOLLOWING FIELDS: {matched_fields}")
         print("*" * 40)
 
     # Filter rows where 'include_nwb' == 'y'
+    #CATEGORICAL: NORMALIZE ONLY THE FEW DISTINCT VALUES, THEN MATCH ROWS ON CATEGORY CODES
     if 'include_nwb' in lstExtractionFields.columns:
-        lstExtractionFields = lstExtractionFields[
-            lstExtractionFields['include_nwb'].astype(str).str.lower() == 'y'
-        ]
+        include_nwb = lstExtractionFields['include_nwb'].astype('category')
+        include_values = [c for c in include_nwb.cat.categories if str(c).lower() == 'y']
+        lstExtractionFields = lstExtractionFields[include_nwb.isin(include_values)]
 
-    mask = (
-        lstExtractionFields['stimulus_notes_file'].notna() &
-        lstExtractionFields['stimulus_notes_file'].str.strip().ne('') &
-        lstExtractionFields['notes_file'].notna() &
-        lstExtractionFields['notes_file'].str.strip().ne('')
-    )
+    #MISSING VALUES BECOME '' SO ONE LENGTH TEST COVERS BOTH notna AND NON-BLANK; BOTH COLUMNS IN ONE (ROWS x 2) ARRAY PASS
+    notes_files = lstExtractionFields[['stimulus_notes_file', 'notes_file']].fillna('').to_numpy(dtype=str)
+    mask = (np.char.str_len(np.char.strip(notes_files)) > 0).all(axis=1)
     lstExtractionFields = lstExtractionFields[mask]
 
     return lstExtractionFields
 
 
+def read_sheet_columns(input_file, columns, sheet_name=None):
+    '''Streams a worksheet (openpyxl read_only) into a DataFrame holding only the requested columns (first sheet if sheet_name is None, as pd.read_excel)'''
+    workbook = openpyxl.load_workbook(input_file, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet_name] if sheet_name else workbook.worksheets[0]
+        rows = worksheet.iter_rows(values_only=True)
+        header = next(rows, ())
+        positions = [header.index(col) for col in columns] #ValueError IF A COLUMN IS MISSING (SAME AS usecols)
+        #WITHOUT A <dimension> ELEMENT, read_only ROWS STOP AT THE LAST NON-EMPTY CELL; MISSING TRAILING CELLS READ AS None (NaN IN pd.read_excel)
+        records = [tuple(row[i] if i < len(row) else None for i in positions) for row in rows if any(cell is not None for cell in row)]
+    finally:
+        workbook.close() #READ-ONLY WORKBOOKS KEEP THE ZIP HANDLE OPEN UNTIL CLOSED
+    return pd.DataFrame.from_records(records, columns=columns)
+
+
+@lru_cache(maxsize=32)
+def load_electrode_mapping_sheet(input_filename):
+    '''Electrode mapping workbook (epFile/mapping columns), parsed once per path per process; callers must not modify the result'''
+    return read_sheet_columns(input_filename, ['epFile', 'mapping'])
+
+
 def get_electrode_mapping_data(src_folder_directory, electrode_recordings_file, electrode_device_name, electrode_recordings_type, electrode_recordings_contact_material, electrode_recordings_substrate, electrode_recordings_system, electrode_recordings_location):
     '''Used for electrode measurements table processing (ephys)'''
-    rhd_file = str(PurePath(src_folder_directory).stem) + '.rhd'
-    base_directory = PurePath(src_folder_directory).parts[:-1] #remove last part of path
-    input_filename = Path(output_path, *base_directory, electrode_recordings_file)
+    src = PurePath(src_folder_directory) #PARSE ONCE
+    rhd_file = src.stem + '.rhd'
+    input_filename = Path(output_path, src.parent, electrode_recordings_file) #PARENT = PATH WITHOUT ITS LAST PART
     print(f'\tREAD ELECTRODE MAPPINGS: {input_filename}')
-    input_map = pd.read_excel(input_filename)
+    input_map = load_electrode_mapping_sheet(os.path.abspath(input_filename)) #SESSIONS SHARING A WORKBOOK REUSE ONE PARSE
 
     #PROCESSING FOR ELECTRODE MAPPINGS V1 (LIST OF TUPLES PER ROW); DEFAULT, AND ASSOCIATED .rhd FILE
     electrode_mappings = input_map.loc[input_map['epFile'] == rhd_file]['mapping']
@@ -256,194 +324,232 @@ def get_electrode_mapping_data(src_folder_directory, electrode_recordings_file,
     return electrode_mappings
 
 
-def main():
-    #################################################################
-    # APP CONSTANTS (DEFAULT)
-    researcher_experimenter = ""
-    institution = ""
-    experiment_modality = "1" #ephys
-    #################################################################
-    
+def get_blocks_per_chunk(n_channels, bytes_per_sample=2):
+    '''Intan data blocks per HDF5 chunk so each (channels x samples) chunk is ~target_chunk_bytes (int16 ephys)'''
+    samples_per_chunk = max(1, target_chunk_bytes // (n_channels * bytes_per_sample))
+    return max(1, samples_per_chunk // intan_samples_per_block)
 
-    if len(sys.argv) > 1:
-        args = collectArguments()
-        print("USING CLI ARGUMENTS")
-        print(f'ARGUMENTS COLLECTED: {args}')
-        experiment_modality = args.experiment_modality
-    else:
-        print("MISSING ARGUMENTS; USING DEFAULTS")
-        print(f'\'python {os.path.basename(__file__)} -h\' FOR HELP\n')
-        args.output_path = output_path
-        experiment_modality = experiment_modality
-        args.researcher_experimenter = researcher_experimenter
-        args.institution = institution
-        args.debug = debug
-    
-    lstRecords = load_data(args.input_file, experiment_modality)
-    
-    ##################################################################################
-    #RENAME EXCEL/DATAFRAME FIELD COLUMN NAMES FOR EASIER NWB CONVERSION
-    lstRecords.rename(columns={'session_start_time(YYYY-MM-DD HH:MM)': 'session_start_time'}, inplace=True)
-    lstRecords.rename(columns={'date_of_birth(YYYY-MM-DD)': 'date_of_birth'}, inplace=True)
-    lstRecords.rename(columns={'age(days)': 'age_days'}, inplace=True)
-    ##################################################################################
 
-    for cnt, row in enumerate(lstRecords.itertuples(index=False)):
-        if pd.isna(row.session_id) or str(row.session_id) == '':
-            continue
+def match_session_files(names, prefix, suffix_pattern):
+    '''Names that start with the (literal) session prefix and whose remainder matches a precompiled pattern
+    (prefix compared through os.path.normcase, i.e. case-insensitively on Windows like fnmatch.filter)'''
+    prefix = os.path.normcase(prefix)
+    return [name for name in names if os.path.normcase(name).startswith(prefix) and suffix_pattern.match(name[len(prefix):])]
 
-        print(f"PROCESSING DATASET #{cnt + 1}")
-        unique_identifier = str(uuid.uuid4())            
-        session_id = str(row.session_id) + "_" + unique_identifier
 
-        session_start_time = row.session_start_time
-        
-        #IF NO TIMEZONE INFO, USE LOCAL TIMEZONE
-        if isinstance(session_start_time, pd.Timestamp):
-            if pd.isna(session_start_time):
-                session_start_time = datetime.now(tzlocal())
-            elif session_start_time.tzinfo is None:
-                session_start_time = session_start_time.tz_localize(tzlocal())
-        elif isinstance(session_start_time, str):
-            if not session_start_time:
-                session_start_time = datetime.now(tzlocal())
-            else:
-                session_start_time = pd.to_datetime(session_start_time)
-            if session_start_time.tzinfo is None:
-                session_start_time = session_start_time.tz_localize(tzlocal())
+@lru_cache(maxsize=256)
+def list_folder(folder):
+    '''Names of non-hidden entries in folder (single directory read per folder per process; hidden names are skipped as glob.glob does)'''
+    with os.scandir(folder) as entries:
+        return tuple(entry.name for entry in entries if not entry.name.startswith('.'))
 
-        ##################################################################################
-        # CREATE EXPERIMENTAL SUBJECT OBJECT
-        age = row.age_days
-        subject_description = row.subject_description
-        genotype = row.genotype
-        sex = row.sex
-        if sex == 'Male' or sex == 'M':
-            sex = 'M'
-        elif sex == 'Female' or sex == 'F':
-            sex = 'F'
-        else:
-            sex = 'U'  # unknown
-        subject_id = row.subject_id
-        subject_weight = row.subject_weight
-        date_of_birth = row.date_of_birth
-        subject_strain = row.subject_strain
-        species = row.species
-
-        subject = utils.get_subject(age,
-                                    str(subject_description),
-                                    genotype,
-                                    sex,
-                                    species,
-                                    subject_id,
-                                    subject_weight,
-                                    date_of_birth,
-                                    subject_strain)
-        ##################################################################################
 
-        if researcher_experimenter == '': #from terminal line (takes priority)
-            researcher_experimenter = row.experimenters
-        
-        if institution == '':#from terminal line (takes priority)
-            institution = row.institution
+def ensure_directory(path, created_dirs):
+    '''Creates directory (and parents) only the first time it is requested during a run'''
+    if path not in created_dirs:
+        path.mkdir(parents=True, exist_ok=True)
+        created_dirs.add(path)
 
-            keywords = ['Researchers: ' + str(researcher_experimenter)]
 
-        ##################################################################################
-        # EXTRACT DATA FROM .MAT (MODERN MATLAB USES .h5 FORMAT)
-        ##################################################################################
-        output_filename = None
-        output_filename = str(session_id).replace('/', '_').replace('\\', '_') + '.nwb' # REPLACE SLASHES IN FILENAME WITH UNDERSCORE
-        
-        print(f'\tNWB OUTPUT FILENAME: {output_filename}')
-        Path(output_path).mkdir(parents=True, exist_ok=True)
+created_scratch_dirs = set() #SCRATCH FOLDERS ALREADY CREATED BY THIS (WORKER) PROCESS
 
-        input_path = row.recordings_folder_directory
-        if row.analysis_file:
-            #INDIVIDUAL FILE INGESTION (EXPLICITY DEFINED)
-            input_files = [Path(input_path, str(row.analysis_file))]
-        else:
-            #SCAN ENTIRE DIRECTORY FOR .mat FILES
-            input_files = list(Path(input_path).glob('*.mat')) # JUST MATLAB FOR NOW
 
-        #EVEN ON SCRATCH, CREATE FOLDER STRUCTURE BASED ON INPUT PATH
-        Path(scratch_path, str(Path(input_path).parent.name)).mkdir(parents=True, exist_ok=True)
-        revised_scratch_path = Path(scratch_path, str(Path(input_path).parent.name))
-        Path(args.output_path, str(Path(input_path).parent.name)).mkdir(parents=True, exist_ok=True)
-        dest_path = Path(args.output_path, str(Path(input_path).parent.name), output_filename)
+def process_session(cnt, row, args, experiment_modality, researcher_experimenter, institution, existing_files):
+    '''Converts a single session (spreadsheet row) to NWB; runs in a worker process so must be top-level (picklable)'''
+    row = SimpleNamespace(**row)
+    print(f"PROCESSING DATASET #{cnt + 1}")
+    session_id = row.nwb_session_id
+    session_start_time = row.session_start_time
 
-        existing_files = list(dest_path.parent.glob(f"{cnt}_*.nwb"))
-        for f in existing_files:
-            print(f'FOUND EXISTING FILE: {f}; SKIPPING')
-            continue
+    ##################################################################################
+    # CREATE EXPERIMENTAL SUBJECT OBJECT
+    age = row.age_days
+    subject_description = row.subject_description
+    genotype = row.genotype
+    sex = row.sex
+    subject_id = row.subject_id
+    subject_weight = row.subject_weight
+    date_of_birth = row.date_of_birth
+    subject_strain = row.subject_strain
+    species = row.species
+
+    subject = utils.get_subject(age,
+                                str(subject_description),
+                                genotype,
+                                sex,
+                                species,
+                                subject_id,
+                                subject_weight,
+                                date_of_birth,
+                                subject_strain)
+    ##################################################################################
 
-        if len(input_files) > 0:
-            #CURRENT SETUP FOR SINGLE MATLAB FILE PER SESSION; LOOP THROUGH ALL FILES IN FUTURE
-            filename = input_files[0].name
+    if researcher_experimenter == '': #from terminal line (takes priority)
+        researcher_experimenter = row.experimenters
+    
+    if institution == '':#from terminal line (takes priority)
+        institution = row.institution
 
-            input_filename = Path(input_path, filename)
+        keywords = ['Researchers: ' + str(researcher_experimenter)]
 
-            data_io, mat_file = utils.extract_mat_data_by_key(input_filename, revised_scratch_path)
-            
-        else:
-            print(f'\tNO INPUT FILES FOUND IN: {input_path}')
-            continue
-        
-        # base_input_path = os.path.dirname(input_path)
+    ##################################################################################
+    # EXTRACT DATA FROM .MAT (MODERN MATLAB USES .h5 FORMAT)
+    ##################################################################################
+    output_filename = row.nwb_output_filename
+    
+    print(f'\tNWB OUTPUT FILENAME: {output_filename}')
 
+    input_path = row.recordings_folder_directory
+    if row.analysis_file:
+        #INDIVIDUAL FILE INGESTION (EXPLICITY DEFINED)
+        input_files = [Path(input_path, str(row.analysis_file))]
+    else:
+        #SCAN ENTIRE DIRECTORY FOR .mat FILES
+        input_files = list(Path(input_path).glob('*.mat')) # JUST MATLAB FOR NOW
+
+    #EVEN ON SCRATCH, CREATE FOLDER STRUCTURE BASED ON INPUT PATH (PER WORKER PROCESS TO AVOID COLLISIONS)
+    parent_name = str(Path(input_path).parent.name)
+    revised_scratch_path = Path(scratch_path, parent_name, str(os.getpid()))
+    ensure_directory(revised_scratch_path, created_scratch_dirs) #ONE mkdir PER FOLDER PER WORKER, NOT PER SESSION
+    dest_path = Path(args.output_path, parent_name, output_filename)
+
+    #RESUMED RUNS: LOOK UP PREVIOUS OUTPUTS BY SESSION (THIS RUN'S FILENAME HAS A NEW RANDOM SUFFIX, SO IT NEVER EXISTS YET)
+    #INTAN CONVERSION NEVER OVERWRITES, SO SKIP BEFORE ANY .mat/EXCEL READS
+    if experiment_modality == "1":
+        existing_output = utils.find_session_output(dest_path.parent, row.nwb_output_prefix, '.nwb')
+        if existing_output is not None:
+            print(f'\tINTAN (.rhd) FILE CONVERSION COMPLETE: {existing_output}')
+            return
+
+    #BEHAVIOR: SKIP WHEN THE NEWEST OUTPUT IS NEWER THAN THE META-DATA WORKBOOK AND EVERY FILE IN THE SESSION'S INPUT FOLDER
+    if experiment_modality == "4" and not args.force:
+        existing_output = utils.find_session_output(dest_path.parent, row.nwb_output_prefix, '.zarr' if args.backend == 'zarr' else '.nwb')
+        if existing_output is not None and utils.is_up_to_date(existing_output, os.stat(args.input_file).st_mtime, input_path):
+            print(f'\tNWB FILE UP TO DATE (USE --force TO REWRITE): {existing_output}')
+            return
+
+    for f in existing_files:
+        print(f'FOUND EXISTING FILE: {f}; SKIPPING')
+        continue
+
+    if len(input_files) > 0:
+        #CURRENT SETUP FOR SINGLE MATLAB FILE PER SESSION; LOOP THROUGH ALL FILES IN FUTURE
+        filename = input_files[0].name
+
+        input_filename = Path(input_path, filename)
+
+        data_io, mat_file = utils.extract_mat_data_by_key(input_filename, revised_scratch_path)
         
-        # print(f'\tINPUT PATH: {input_path}, BASE INPUT PATH: {base_input_path}')
-        # last_folder_in_path = os.path.basename(os.path.normpath(base_input_path))
-        
-        # if last_folder_in_path == dataset['src_folder_directory']:
-        #     #ASSUMED DUPLICATE FOLDERS AT END OF PATH
-        #     input_filename = Path(base_input_path, filename)
-        # else:
-        #     input_filename = Path(base_input_path, dataset['src_folder_directory'], filename)
-
-        print(f'\tINPUT FILE: {input_filename}')
-        print(f'\tOUTPUT FILE: {dest_path}')
-        
-        ##################################################################################
-        # PROCESS META-DATA, GENERAL
-        session_description = row.session_description
-        surgery = None  # DEFAULT VALUE FOR SURGERY
-        pharmacology = None  # DEFAULT VALUE FOR PHARMACOLOGY
-        manual_start_time = None # DEFAULT VALUE FOR MANUAL START TIME
-        exp_identifier = 'NA'
-        # CONCATENATE STIMULUS NOTES (DEPENDS ON EXPERIMENT MODALITY)
-        stimulus_notes = 'NA'
-        pharmacology = 'NA'
-        notes = 'NA'
-        if experiment_modality == "4":
-            stimulus_notes_file = row.stimulus_notes_file
-            if pd.notna(stimulus_notes_file) and str(stimulus_notes_file).strip().lower() != 'nan' and len(str(stimulus_notes_file).strip()) > 0:
-                path_stub = input_filename.parts[:-1]
-                data_filename = Path(*path_stub, str(stimulus_notes_file))
-                stimulus_notes = behavior.add_str_data(data_filename, 'stimulus_notes')
-                print(f'\tINCLUDING DATA FROM FILE: {stimulus_notes_file}')
+    else:
+        print(f'\tNO INPUT FILES FOUND IN: {input_path}')
+        return
+    
+    # base_input_path = os.path.dirname(input_path)
 
+    
+    # print(f'\tINPUT PATH: {input_path}, BASE INPUT PATH: {base_input_path}')
+    # last_folder_in_path = os.path.basename(os.path.normpath(base_input_path))
+    
+    # if last_folder_in_path == dataset['src_folder_directory']:
+    #     #ASSUMED DUPLICATE FOLDERS AT END OF PATH
+    #     input_filename = Path(base_input_path, filename)
+    # else:
+    #     input_filename = Path(base_input_path, dataset['src_folder_directory'], filename)
+
+    print(f'\tINPUT FILE: {input_filename}')
+    print(f'\tOUTPUT FILE: {dest_path}')
+    
+    ##################################################################################
+    # PROCESS META-DATA, GENERAL
+    session_description = row.session_description
+    surgery = None  # DEFAULT VALUE FOR SURGERY
+    pharmacology = None  # DEFAULT VALUE FOR PHARMACOLOGY
+    manual_start_time = None # DEFAULT VALUE FOR MANUAL START TIME
+    exp_identifier = 'NA'
+    # CONCATENATE STIMULUS NOTES (DEPENDS ON EXPERIMENT MODALITY)
+    stimulus_notes = 'NA'
+    pharmacology = 'NA'
+    notes = 'NA'
+    if experiment_modality == "4":
+        stimulus_notes_file = row.stimulus_notes_file
+        if pd.notna(stimulus_notes_file) and str(stimulus_notes_file).strip().lower() != 'nan' and len(str(stimulus_notes_file).strip()) > 0:
+            data_filename = input_filename.parent / str(stimulus_notes_file)
+            stimulus_notes = behavior.add_str_data(data_filename, 'stimulus_notes')
+            print(f'\tINCLUDING DATA FROM FILE: {stimulus_notes_file}')
+
+        notes_file = row.notes_file
+        if pd.notna(notes_file) and str(notes_file).strip().lower() != 'nan' and len(str(notes_file).strip()) > 0:
             notes_file = row.notes_file
-            if pd.notna(notes_file) and str(notes_file).strip().lower() != 'nan' and len(str(notes_file).strip()) > 0:
-                notes_file = row.notes_file
-                path_stub = input_filename.parts[:-1]
-                data_filename = Path(*path_stub, notes_file)
-                notes = behavior.add_str_data(data_filename, 'notes')
-                print(f'\tINCLUDING DATA FROM FILE: {notes_file}')
-        else:
-            if row.stimulus_notes_include == 1:  # 1 (include) or 0 (do not include)
-                stimulus_notes = "Stimulus paradigm: " + str(row.stimulus_notes_paradigm) + "; "
-                if row.stimulus_notes_direct_electrical_stimulation == 1:
-                    stimulus_notes += "Direct electrical stimulation paradigm: " + str(
-                        row.stimulus_notes_direct_electrical_stimulation_paradigm) + "; "
+            data_filename = input_filename.parent / notes_file
+            notes = behavior.add_str_data(data_filename, 'notes')
+            print(f'\tINCLUDING DATA FROM FILE: {notes_file}')
+    else:
+        #BUILT COLUMN-WISE IN main
+        stimulus_notes = row.nwb_stimulus_notes
+        pharmacology = row.nwb_pharmacology
 
-            if row.pharmacology_notes_anesthetized_during_recording == 1: # 1 (include) or 0 (do not include)
-                pharmacology = row.pharmacology
+    #TODO - ADD surgery (concatenated) if exists in dataframe
 
-        #TODO - ADD surgery (concatenated) if exists in dataframe
+    ##################################################################################
+    # PROCESS META-DATA, ACCORDING TO EXPERIMENT MODALITY
+    ##################################################################################
+    if experiment_modality == "1":
+        ##################################################################################
+        # CREATE/CONVERT ELECTRODES TABLE(S) OBJECT
+        electrode_recordings_file = row.electrode_recordings
+        electrode_mappings = get_electrode_mapping_data(input_filename,
+                            electrode_recordings_file,
+                            row.electrode_device_name,
+                            row.electrode_recordings_type,
+                            row.electrode_recordings_contact_material,
+                            row.electrode_recordings_substrate,
+                            row.electrode_recordings_system,
+                            row.electrode_recordings_location).tolist()[0]
+
+        #ref: https://stackoverflow.com/questions/51051136/extracting-content-between-curly-braces-in-python
+        grouped_electrode_mappings = [match.group(1) for match in electrode_mapping_pattern.finditer(electrode_mappings)]
+        electrode_mappings = list(enumerate(grouped_electrode_mappings))
+        #CHUNK = ALL CHANNELS x T SAMPLES, SIZED TO ~1 MiB; KEEP INTAN DEFAULT WHEN CHANNEL COUNT UNKNOWN
+        blocks_per_chunk = get_blocks_per_chunk(len(grouped_electrode_mappings)) if grouped_electrode_mappings else 1000
+
+        print(f'mappings: {type(grouped_electrode_mappings), len(grouped_electrode_mappings), grouped_electrode_mappings}')
+
+        electrode_recordings_description = 'Type: ' + str(
+            row.electrode_recordings_type) + '; Contact material: ' + str(
+            row.electrode_recordings_contact_material) + '; Substrate: ' + str(
+            row.electrode_recordings_substrate)
+
+        electrode_headers = {'electrode_device_name': row.electrode_device_name,
+                                'electrode_recordings_description': electrode_recordings_description,
+                                'electrode_recordings_system': row.electrode_recordings_system,
+                                'electrode_recordings_location': row.electrode_recordings_location,
+                                'electrode_filtering': row.electrode_filtering}
 
         ##################################################################################
-        #CREATE NWB FILE (BASIC META-DATA)
+        print(f'\tCONVERTING INTAN (.rhd) FILE TO NWB: {dest_path}')
+        convert_to_nwb(intan_filename=str(input_filename),
+                        nwb_filename=str(dest_path),
+                        session_description=session_description,
+                        blocks_per_chunk=blocks_per_chunk,
+                        use_compression=True,
+                        compression_level=4,
+                        lowpass_description='Unknown lowpass filtering process',
+                        highpass_description='Unknown lowpass filtering process',
+                        merge_files=False,
+                        subject=subject,
+                        surgery=surgery,
+                        stimulus_notes=stimulus_notes,
+                        pharmacology=pharmacology,
+                        manual_start_time=manual_start_time,
+                        exp_identifier=str(exp_identifier),
+                        electrode_mappings=electrode_mappings,
+                        experimenter=researcher_experimenter,
+                        institution=institution,
+                        electrode_headers=electrode_headers)
+
+    elif experiment_modality == "4":
+        ##################################################################################
+        #CREATE NWB FILE (BASIC META-DATA); ONLY BEHAVIOR BUILDS IN MEMORY (convert_to_nwb CREATES ITS OWN)
         nwbfile = pynwb.NWBFile(session_description = session_description,
                                 identifier = exp_identifier,
                                 session_start_time = session_start_time,
@@ -458,440 +564,489 @@ def main():
                                 notes=notes
                                 )
 
-        ##################################################################################
-        # PROCESS META-DATA, ACCORDING TO EXPERIMENT MODALITY
-        ##################################################################################
-        if experiment_modality == "1":
-            ##################################################################################
-            # CREATE/CONVERT ELECTRODES TABLE(S) OBJECT
-            electrode_recordings_file = row.electrode_recordings
-            electrode_mappings = get_electrode_mapping_data(input_filename,
-                                electrode_recordings_file,
-                                row.electrode_device_name,
-                                row.electrode_recordings_type,
-                                row.electrode_recordings_contact_material,
-                                row.electrode_recordings_substrate,
-                                row.electrode_recordings_system,
-                                row.electrode_recordings_location).tolist()[0]
-
-            #ref: https://stackoverflow.com/questions/51051136/extracting-content-between-curly-braces-in-python
-            grouped_electrode_mappings = re.findall(r'\{(.*?)\}', electrode_mappings)
-            electrode_mappings = [(counter, item) for counter, item in enumerate(grouped_electrode_mappings)]
-
-            print(f'mappings: {type(grouped_electrode_mappings), len(grouped_electrode_mappings), grouped_electrode_mappings}')
-
-            electrode_recordings_description = 'Type: ' + str(
-                row.electrode_recordings_type) + '; Contact material: ' + str(
-                row.electrode_recordings_contact_material) + '; Substrate: ' + str(
-                row.electrode_recordings_substrate)
-
-            electrode_headers = {'electrode_device_name': row.electrode_device_name,
-                                    'electrode_recordings_description': electrode_recordings_description,
-                                    'electrode_recordings_system': row.electrode_recordings_system,
-                                    'electrode_recordings_location': row.electrode_recordings_location,
-                                    'electrode_filtering': row.electrode_filtering}
-
-            ##################################################################################
-            if os.path.isfile(dest_path) != True:  # file conversion completed
-                print(f'\tCONVERTING INTAN (.rhd) FILE TO NWB: {dest_path}')
-                convert_to_nwb(intan_filename=str(input_filename),
-                                nwb_filename=str(dest_path),
-                                session_description=session_description,
-                                blocks_per_chunk=1000,
-                                use_compression=True,
-                                compression_level=4,
-                                lowpass_description='Unknown lowpass filtering process',
-                                highpass_description='Unknown lowpass filtering process',
-                                merge_files=False,
-                                subject=subject,
-                                surgery=surgery,
-                                stimulus_notes=stimulus_notes,
-                                pharmacology=pharmacology,
-                                manual_start_time=manual_start_time,
-                                exp_identifier=str(exp_identifier),
-                                electrode_mappings=electrode_mappings,
-                                experimenter=researcher_experimenter,
-                                institution=institution,
-                                electrode_headers=electrode_headers)
-            else:
-                print(f'\tINTAN (.rhd) FILE CONVERSION COMPLETE')
-
-        elif experiment_modality == "4":
-            if row.institution == 'Boston University':
-                print("ECONOMO LAB DATA PROCESSING")
-                print(f'\tRESULT NWB FILE WILL BE SAVED TO: {dest_path}')
-                performance_lab = 'Economo Lab'
-                
-                ##########################################################
-                # THIS WAS MULTI-MODAL DATA; BEHAVIOR + EPHYS
-                ##########################################################
-                print(data_io.keys()) 
-                
-                for key in data_io.keys():
-                    print(f'PROCESSING "{key}" DATA')
-                    if key == 'bp': #additional subprocessing
-                        for subkey in data_io[key].keys():
+        if row.institution == 'Boston University':
+            print("ECONOMO LAB DATA PROCESSING")
+            print(f'\tRESULT NWB FILE WILL BE SAVED TO: {dest_path}')
+            verbose = args.debug #PER-KEY/LEAF DIAGNOSTICS ONLY WITH --debug (KEEPS WORKER STDOUT QUIET)
+            performance_lab = 'Economo Lab'
+            
+            ##########################################################
+            # THIS WAS MULTI-MODAL DATA; BEHAVIOR + EPHYS
+            ##########################################################
+            if verbose:
+                print(data_io.keys())
+
+            #ONE PROCESSING MODULE PER TOP-LEVEL KEY (NOT PER LEAF); EACH LEAF CONTAINER IS NAMED AFTER ITS TIME SERIES
+            behavior_modules = {}
+            def get_behavior_module(key):
+                if key not in behavior_modules:
+                    behavior_modules[key] = nwbfile.create_processing_module(name=key, description=row.sensor_description)
+                return behavior_modules[key]
+            
+            for key in data_io.keys():
+                print(f'PROCESSING "{key}" DATA')
+                if key == 'bp': #additional subprocessing
+                    for subkey in data_io[key].keys():
+                        if verbose:
                             print(f"PROCESSING {key} :: {subkey} SUB-KEY DATA")
-                            if subkey == 'ev':
-                                #process lick events
-                                behavior_events = behavior.add_behavioral_event_data('lick', data_io[key][subkey])
-                                nwbfile.add_acquisition(behavior_events)
-                            elif subkey == 'protocol':
-                                for event_key in data_io[key][subkey].keys():
+                        if subkey == 'ev':
+                            #process lick events
+                            behavior_events = behavior.add_behavioral_event_data('lick', data_io[key][subkey])
+                            nwbfile.add_acquisition(behavior_events)
+                        elif subkey == 'protocol':
+                            for event_key in data_io[key][subkey].keys():
+                                if verbose:
                                     print(f"\tPROCESSING {key} :: {subkey} :: {event_key} DATA")
-                                    time_series_name = f'{key}-{subkey}-{event_key}'
-                                    time_series_description = f'{key}-{subkey} {event_key} data from Economo lab'
-                                    behavioral_time_series = behavior.add_timeseries_data(np.array(data_io[key][subkey][event_key]), float(row.video_sampling_rate), time_series_name, time_series_description)
-                                    behavior_module = nwbfile.create_processing_module(
-                                        name=time_series_name, description=str(row.sensor_description)
-                                    )
-                                    behavior_module.add(behavioral_time_series)
-                            elif subkey == 'stim':
+                                time_series_name = f'{key}-{subkey}-{event_key}'
+                                time_series_description = f'{key}-{subkey} {event_key} data from Economo lab'
+                                behavioral_time_series = behavior.add_timeseries_data(utils.read_contiguous(data_io[key][subkey][event_key]), float(row.video_sampling_rate), time_series_name, time_series_description, container_name=time_series_name, backend=args.backend)
+                                get_behavior_module(key).add(behavioral_time_series)
+                        elif subkey == 'stim':
+                            if verbose:
                                 print(f"\tPROCESSING {key} :: {subkey} SUB-KEY DATA")
-                                for stim_key in data_io[key][subkey].keys():
+                            for stim_key in data_io[key][subkey].keys():
+                                if verbose:
                                     print(f'{stim_key=}')
-                                    time_series_name = f'{key}-{subkey}-{stim_key}'
-                                    time_series_description = f'{key}-{subkey} {stim_key} data from Economo lab'
-                                    behavioral_time_series = behavior.add_timeseries_data(np.array(data_io[key][subkey][stim_key]), float(row.video_sampling_rate), time_series_name, time_series_description)
-                                    behavior_module = nwbfile.create_processing_module(
-                                        name=time_series_name, description=str(row.sensor_description)
-                                    )
-                                    behavior_module.add(behavioral_time_series)
-                            else:
+                                time_series_name = f'{key}-{subkey}-{stim_key}'
+                                time_series_description = f'{key}-{subkey} {stim_key} data from Economo lab'
+                                behavioral_time_series = behavior.add_timeseries_data(utils.read_contiguous(data_io[key][subkey][stim_key]), float(row.video_sampling_rate), time_series_name, time_series_description, container_name=time_series_name, backend=args.backend)
+                                get_behavior_module(key).add(behavioral_time_series)
+                        else:
+                            if verbose:
                                 print(f'{subkey=}')
-                                time_series_name = f'{key}-{subkey}'
-                                time_series_description = f'{key}-{subkey} data from Economo lab'
-                                behavioral_time_series = behavior.add_timeseries_data(data_io[key][subkey], float(row.video_sampling_rate), time_series_name, time_series_description)
-                                behavior_module = nwbfile.create_processing_module(
-                                    name=time_series_name, description=str(row.sensor_description)
-                                )
-                                behavior_module.add(behavioral_time_series)
-                    elif key == 'me': #additional subprocessing
-                        subdata = data_io[key]
-                        
-                        # If 'me' is a dict, iterate subkeys; else treat 'me' as direct data
-                        if isinstance(subdata, dict):
+                            time_series_name = f'{key}-{subkey}'
+                            time_series_description = f'{key}-{subkey} data from Economo lab'
+                            behavioral_time_series = behavior.add_timeseries_data(data_io[key][subkey], float(row.video_sampling_rate), time_series_name, time_series_description, container_name=time_series_name, backend=args.backend)
+                            get_behavior_module(key).add(behavioral_time_series)
+                elif key == 'me': #additional subprocessing
+                    subdata = data_io[key]
+                    
+                    # If 'me' is a dict, iterate subkeys; else treat 'me' as direct data
+                    if isinstance(subdata, dict):
+                        if verbose:
                             print(subdata.keys())
-                            for subkey in subdata.keys():
-                                if subkey == 'moveThresh':
-                                    continue
-                                elif subkey == 'data':
-                                    #SPECIAL PROCESSING FOR DATA (BUT STILL TIME-SERIES)
-                                    ref_array = data_io[key] 
-                                    cluster_ts = behavior.load_cluster_timeseries(subdata['data'], mat_file)
-                                    behavior.add_timeseries_data(cluster_ts, float(row.video_sampling_rate), 'movement_data', 'movement data from Economo lab')
+                        for subkey in subdata.keys():
+                            if subkey == 'moveThresh':
+                                continue
+                            elif subkey == 'data':
+                                #SPECIAL PROCESSING FOR DATA (BUT STILL TIME-SERIES)
+                                ref_array = data_io[key] 
+                                cluster_ts = behavior.load_cluster_timeseries(subdata['data'], mat_file)
+                                behavior.add_timeseries_data(cluster_ts, float(row.video_sampling_rate), 'movement_data', 'movement data from Economo lab', backend=args.backend)
+                            if verbose:
                                 print(f"PROCESSING {key} :: {subkey} SUB-KEY DATA")
-                                time_series_name = f'{key}-{subkey}'
-                                time_series_description = f'{key} {subkey} data from Economo lab'
-                                behavioral_time_series = behavior.add_timeseries_data(
-                                    subdata[subkey], 
-                                    float(row.video_sampling_rate), 
-                                    time_series_name, 
-                                    time_series_description
-                                )
-                                behavior_module = nwbfile.create_processing_module(
-                                    name=time_series_name, description=str(row.sensor_description)
-                                )
-                                behavior_module.add(behavioral_time_series)
-                        else:
-                            # 'me' holds data directly
-                            print(f"PROCESSING {key} DIRECT DATA")
-                            time_series_name = f'{key}'
-                            time_series_description = f'{key} data from Economo lab'
+                            time_series_name = f'{key}-{subkey}'
+                            time_series_description = f'{key} {subkey} data from Economo lab'
                             behavioral_time_series = behavior.add_timeseries_data(
-                                subdata,
-                                float(row.video_sampling_rate),
-                                time_series_name,
-                                time_series_description
+                                subdata[subkey], 
+                                float(row.video_sampling_rate), 
+                                time_series_name, 
+                                time_series_description,
+                                container_name=time_series_name,
+                                backend=args.backend
                             )
-                            behavior_module = nwbfile.create_processing_module(
-                                name=time_series_name, description=str(row.sensor_description)
-                            )
-                            behavior_module.add(behavioral_time_series)
-                    elif key in ('ex', 'pth', 'sglx', 'trials'): #ignore - meta-data
-                        print(f'IGNORING {key}')
-                        continue
-                    elif key == 'meta':
-                        ##########################################################
-                        print(f'{key} CONTAINS META-DATA FOR EPHYS')
-                        ##########################################################
-                        #under meta, probe
-                        device_description = str(row.device_description)
-                        serial_number = data_io[key]['probe']['serialNum']
-                        electrode_group_location = data_io[key]['probe']['loc']
-
-                        ephys_device = nwbfile.create_device(
-                            name="ephys device",
-                            description=device_description,
-                            manufacturer="",
-                            model_number="",
-                            model_name="",
-                            serial_number=str(serial_number),
-                        )
-                        electrode_group = nwbfile.create_electrode_group(
-                            name="1",
-                            description="",
-                            device=ephys_device,
-                            location=str(electrode_group_location),
-                        )
-                        nwbfile.add_electrode(
-                            group=electrode_group,
-                            #label="",
-                            location=str(electrode_group_location),
-                        )
-                    elif key == 'clu' or key == 'obj': #'obj' contains 'clu' on some datasets
-                        ##########################################################
-                        print(f'{key} CONTAINS DATA FOR EPHYS')
-                        ##########################################################
-                        try:
-                            if key == 'obj' and 'clu' in data_io[key]:
-                                ref_array = data_io[key]['clu']
-                            else:
-                                ref_array = data_io[key]
-
-                            spike_sorted_clusters_data = ephys.process_spike_data(ref_array, mat_file)
-                            ephys.create_electrode_table(nwbfile, spike_sorted_clusters_data, ephys_device)
-
-                            # Create ElectricalSeries
-                            electrical_series = ephys.create_electrical_series(nwbfile, spike_sorted_clusters_data)
-                            nwbfile.add_acquisition(electrical_series)
-
-                            print(f"Processed {len(spike_sorted_clusters_data)} spike clusters")
-
-                        except Exception as e:
-                            print(f"Error processing {key}: {str(e)}")
-                            continue
-                        sys.exit()
+                            get_behavior_module(key).add(behavioral_time_series)
                     else:
-                        print(f'{key=}')
-                        time_series_name = key
-                        time_series_description = f'{key} data from {performance_lab}'
-                        behavioral_time_series = behavior.add_timeseries_data(data_io[key], float(row.video_sampling_rate), str(key), time_series_description)
-                        behavior_module = nwbfile.create_processing_module(
-                            name=time_series_name, description=str(row.sensor_description)
+                        # 'me' holds data directly
+                        if verbose:
+                            print(f"PROCESSING {key} DIRECT DATA")
+                        time_series_name = f'{key}'
+                        time_series_description = f'{key} data from Economo lab'
+                        behavioral_time_series = behavior.add_timeseries_data(
+                            subdata,
+                            float(row.video_sampling_rate),
+                            time_series_name,
+                            time_series_description,
+                            container_name=time_series_name,
+                            backend=args.backend
                         )
-                        behavior_module.add(behavioral_time_series)
-                    
+                        get_behavior_module(key).add(behavioral_time_series)
+                elif key in ('ex', 'pth', 'sglx', 'trials'): #ignore - meta-data
+                    if verbose:
+                        print(f'IGNORING {key}')
+                    continue
+                elif key == 'meta':
+                    ##########################################################
+                    print(f'{key} CONTAINS META-DATA FOR EPHYS')
+                    ##########################################################
+                    #under meta, probe
+                    device_description = row.device_description
+                    #READ THE (SMALL) PROBE GROUP ONCE; INDEX THE DICT THEREAFTER
+                    probe_meta = {k: (v[()] if isinstance(v, h5py.Dataset) else v) for k, v in data_io[key]['probe'].items()}
+                    serial_number = probe_meta['serialNum']
+                    electrode_group_location = probe_meta['loc']
+
+                    ephys_device = nwbfile.create_device(
+                        name="ephys device",
+                        description=device_description,
+                        manufacturer="",
+                        model_number="",
+                        model_name="",
+                        serial_number=str(serial_number),
+                    )
+                    electrode_group = nwbfile.create_electrode_group(
+                        name="1",
+                        description="",
+                        device=ephys_device,
+                        location=str(electrode_group_location),
+                    )
+                    nwbfile.add_electrode(
+                        group=electrode_group,
+                        #label="",
+                        location=str(electrode_group_location),
+                    )
+                elif key == 'clu' or key == 'obj': #'obj' contains 'clu' on some datasets
+                    ##########################################################
+                    print(f'{key} CONTAINS DATA FOR EPHYS')
+                    ##########################################################
+                    try:
+                        if key == 'obj' and 'clu' in data_io[key]:
+                            ref_array = data_io[key]['clu']
+                        else:
+                            ref_array = data_io[key]
+
+                        ephys.process_ephys(ref_array, nwbfile, ephys_device, mat_file)
+
+                    except Exception as e:
+                        print(f"Error processing {key}: {str(e)}")
+                    continue
+                else:
+                    if verbose:
+                        print(f'{key=}')
+                    time_series_name = key
+                    time_series_description = f'{key} data from {performance_lab}'
+                    behavioral_time_series = behavior.add_timeseries_data(data_io[key], float(row.video_sampling_rate), str(key), time_series_description, container_name=time_series_name, backend=args.backend)
+                    get_behavior_module(key).add(behavioral_time_series)
+                
+                if verbose:
                     print(f'\tADDED {time_series_name} DATA TO NWB FILE')
+        else:
+
+            ##################################################################################
+            # CREATE IMAGE SERIES OBJECT TO STORE VIDEO DATA
+            video_sampling_rate = row.video_sampling_rate
+            last_folder_in_path = os.path.basename(os.path.normpath(input_filename))
+            session_path = input_filename.parent
+
+            #LIST SESSION FOLDER ONCE; EVERY FILE PATTERN BELOW IS MATCHED AGAINST THIS LISTING
+            session_folder = os.fspath(session_path)
+            session_folder_files = list_folder(session_folder)
+
+            video_file_path = '' #.avi
+            for video_file_path in match_session_files(session_folder_files, last_folder_in_path + '_', session_file_patterns['video']):
+                video_file_path = os.path.join(session_folder, video_file_path)
+                print(f'\tINCLUDING/REFERENCING VIDEO FILE: {video_file_path}')
+            relative_path_video_file = behavior.get_video_reference_data(video_file_path, dest_path)
+
+            video_location_file_path = '' #.csv
+            for video_location_file_path in match_session_files(session_folder_files, session_id + '_', session_file_patterns['torso']):
+                video_location_file_path = os.path.join(session_folder, video_location_file_path)
+                print(f'\tINCLUDING/REFERENCING VIDEO LOCATION FILE: {video_location_file_path}')
+            if video_location_file_path == '':
+                relative_path_video_location_file = video_location_file_path
             else:
+                relative_path_video_location_file = behavior.get_video_reference_data(video_location_file_path, dest_path)
+
+            for comments_file_path in match_session_files(session_folder_files, session_id + '_', session_file_patterns['ellipse']):
+                comments_file_path = os.path.join(session_folder, comments_file_path)
+                print(f'\tINCLUDING COMMENTS [RE: VIDEO FILE] FROM FILE: {comments_file_path}')
+
+            sensor_time_series_name = 'raw_sensor_data'
+            for sensor_file_path in match_session_files(session_folder_files, session_id + '_', session_file_patterns['excel']):
+                sensor_file_path = os.path.join(session_folder, sensor_file_path)
+                print(f'\tINCLUDING {sensor_time_series_name} DATA FROM FILE: {sensor_file_path}')
+
+            data36_time_series_name = 'data_36columns'
+            for time_series_file_path in match_session_files(session_folder_files, session_id + '_', session_file_patterns['36data']):
+                time_series_file_path = os.path.join(session_folder, time_series_file_path)
+                print(f'\tINCLUDING {data36_time_series_name} DATA FROM FILE: {time_series_file_path}')
+
+            labchart_time_series_name = 'raw_labchart_data'
+            for other_file_path in match_session_files(session_folder_files, session_id + '_', session_file_patterns['LCmat']):
+                other_file_path = os.path.join(session_folder, other_file_path)
+                print(f'\tINCLUDING {labchart_time_series_name} LOG DATA FROM FILE: {other_file_path}')
+
+            #THE SESSION FILES ARE INDEPENDENT; READ THEM CONCURRENTLY SO STORAGE (NFS) LATENCY OVERLAPS, THEN ADD IN ORDER
+            with ThreadPoolExecutor(max_workers=prefetch_workers) as prefetch:
+                img_comments = prefetch.submit(behavior.extract_img_series_data, comments_file_path)
+                sensor_time_series = prefetch.submit(behavior.add_timeseries_data, sensor_file_path, 100.0, sensor_time_series_name,
+                                                     row.sensor_description, container_name=sensor_time_series_name, backend=args.backend)
+                data36_time_series = prefetch.submit(behavior.add_timeseries_data, time_series_file_path, 2000.0, data36_time_series_name,
+                                                     str(row.ch3_in_36data) + '|' + str(row.ch4_in_36data) + '|' + str(row.ch5_in_36data) + '|' + str(row.ch6_in_36data),
+                                                     container_name=data36_time_series_name, compressor=args.compressor, backend=args.backend)
+                labchart_time_series = prefetch.submit(behavior.add_timeseries_data, other_file_path, float(row.LCmat_sampling_rate), labchart_time_series_name,
+                                                       row.LCmat_channel_description, container_name=labchart_time_series_name, compressor=args.compressor, backend=args.backend)
+
+            device = nwbfile.create_device(
+                name=row.device_name,
+                description=row.device_description,
+                manufacturer=row.device_manufacturer
+            )
 
-                ##################################################################################
-                # CREATE IMAGE SERIES OBJECT TO STORE VIDEO DATA
-                video_sampling_rate = row.video_sampling_rate
-                last_folder_in_path = os.path.basename(os.path.normpath(input_filename))
-                path_stub = input_filename.parts[:-1]
-                glob_pattern = last_folder_in_path + '_*.avi'
-                base_path_with_pattern = str(Path(*path_stub, glob_pattern))
-
-                video_file_path = '' #.avi
-                for video_file_path in glob.glob(base_path_with_pattern, recursive=False):
-                    print(f'\tINCLUDING/REFERENCING VIDEO FILE: {video_file_path}')
-                relative_path_video_file = behavior.get_video_reference_data(video_file_path, dest_path)
-
-                video_location_file_path = '' #.csv
-                glob_pattern = session_id + '_*_*_torso.csv'
-                base_path_with_pattern = str(Path(*path_stub, glob_pattern))
-                for video_location_file_path in glob.glob(base_path_with_pattern, recursive=False):
-                    print(f'\tINCLUDING/REFERENCING VIDEO LOCATION FILE: {video_location_file_path}')
-                if video_location_file_path == '':
-                    relative_path_video_location_file = video_location_file_path
-                else:
-                    relative_path_video_location_file = behavior.get_video_reference_data(video_location_file_path, dest_path)
-
-                glob_pattern = session_id + '_*_ellipse_*.mat'
-                base_path_with_pattern = str(Path(*path_stub, glob_pattern))
-                for comments_file_path in glob.glob(base_path_with_pattern, recursive=False):
-                    print(f'\tINCLUDING COMMENTS [RE: VIDEO FILE] FROM FILE: {comments_file_path}')
-                img_comments = behavior.extract_img_series_data(comments_file_path)
-
-                device = nwbfile.create_device(
-                    name=row.device_name,
-                    description=row.device_description,
-                    manufacturer=row.device_manufacturer
-                )
-
-                ##################################################################################
-                # https://pynwb.readthedocs.io/en/stable/tutorials/domain/images.html
-                # Note: This approach references the video files and does not include them in nwb file
-                behavior_external_file = ImageSeries(
-                    name="ImageSeries",
-                    external_file=[relative_path_video_file, relative_path_video_location_file],
-                    description=session_description,
-                    format="external",
-                    rate=float(video_sampling_rate),
-                    comments=img_comments
-                )
-                nwbfile.add_acquisition(behavior_external_file)
-                ################################################################################
-
-                ##################################################################################
-                # ADD SENSOR DATA AS NDARRAY (TIME SERIES)
-                time_series_name = 'raw_sensor_data'
-                sensor_description = row.sensor_description
-
-                video_sampling_rate_Hz = 100.0 #float
-
-                glob_pattern = session_id + '_*_excel.xlsx' # .xlsx
-                base_path_with_pattern = str(Path(*path_stub, glob_pattern))
-                for sensor_file_path in glob.glob(base_path_with_pattern, recursive=False):
-                    print(f'\tINCLUDING {time_series_name} DATA FROM FILE: {sensor_file_path}')
-
-                # CREATE NWB BEHAVIOR MODEL [TO WHICH WE WILL ADD TIME SERIES, GEOMETRY, ETC.]
-                behavioral_time_series = behavior.add_timeseries_data(sensor_file_path, video_sampling_rate_Hz, time_series_name, sensor_description)
-
-                behavior_module = nwbfile.create_processing_module(
-                    name=time_series_name, description=sensor_description
-                )
-                behavior_module.add(behavioral_time_series)
-                ##################################################################################
-
-                ##################################################################################
-                # ADD DATA [36DATA] AS NDARRAY (TIME SERIES)
-                ##################################################################################
-                time_series_name = 'data_36columns'
-                time_series_description = str(row.ch3_in_36data) + '|' + str(row.ch4_in_36data) + '|' + str(row.ch5_in_36data) + '|' + str(row.ch6_in_36data)
-                video_sampling_rate_Hz = 2000.0  # sampling rate in Hz
-
-                glob_pattern = session_id + '_*_36data.mat' # .mat
-                base_path_with_pattern = str(Path(*path_stub, glob_pattern))
-                for time_series_file_path in glob.glob(base_path_with_pattern, recursive=False):
-                    print(f'\tINCLUDING {time_series_name} DATA FROM FILE: {time_series_file_path}')
-
-                behavioral_time_series = behavior.add_timeseries_data(time_series_file_path, video_sampling_rate_Hz,
-                                                                        time_series_name, time_series_description)
-
-                behavior_module = nwbfile.create_processing_module(
-                    name=time_series_name, description=time_series_description
-                )
-                behavior_module.add(behavioral_time_series)
-                ##################################################################################
-
-                ##################################################################################
-                # ADD OTHER META-DATA [LCmat] AS NDARRAY (TIME SERIES)
-                ##################################################################################
-                time_series_name = 'raw_labchart_data'
-                time_series_description =row.LCmat_channel_description
-                video_sampling_rate_Hz = float(row.LCmat_sampling_rate) # sampling rate in Hz
-
-                glob_pattern = session_id + '_*_LCmat.mat'  # .mat
-                base_path_with_pattern = str(Path(*path_stub, glob_pattern))
-                for other_file_path in glob.glob(base_path_with_pattern, recursive=False):
-                    print(f'\tINCLUDING {time_series_name} LOG DATA FROM FILE: {other_file_path}')
-
-                behavioral_time_series = behavior.add_timeseries_data(other_file_path, video_sampling_rate_Hz,
-                                                                        time_series_name, time_series_description)
-
-                behavior_module = nwbfile.create_processing_module(
-                    name=time_series_name, description=time_series_description
-                )
-                behavior_module.add(behavioral_time_series)
-
-                ##################################################################################
-                # ADD PROCESSING DATA REF AS TUPLE
-                ##################################################################################
-                processing_file = row.processing_file
-                name = 'signal_percentiles'
-                description = 'Percentiles of the 36-data signals.'
-
-                if processing_file:
-                    data_filename = Path(*path_stub, processing_file)
-                    processing_data = behavior.add_matrix_data(data_filename, 'processing', description)
-
-                    behavior_module = nwbfile.create_processing_module(
-                        name=name, description=description
-                    )
+            ##################################################################################
+            # https://pynwb.readthedocs.io/en/stable/tutorials/domain/images.html
+            # Note: This approach references the video files and does not include them in nwb file
+            behavior_external_file = ImageSeries(
+                name="ImageSeries",
+                external_file=[relative_path_video_file, relative_path_video_location_file],
+                description=session_description,
+                format="external",
+                rate=float(video_sampling_rate),
+                comments=img_comments.result()
+            )
+            nwbfile.add_acquisition(behavior_external_file)
+            ################################################################################
 
-                    behavior_module.add(processing_data)
+            ##################################################################################
+            # ADD SENSOR DATA AS NDARRAY (TIME SERIES)
+            # CREATE NWB BEHAVIOR MODEL [TO WHICH WE WILL ADD TIME SERIES, GEOMETRY, ETC.]
+            #ONE MODULE PER SESSION; EACH CONTAINER IS NAMED AFTER ITS TIME SERIES (DESCRIPTIONS LIVE ON THE TIME SERIES)
+            behavior_module = nwbfile.create_processing_module(
+                name='behavior', description='Behavioral time series and annotations'
+            )
+            behavior_module.add(sensor_time_series.result())
+            ##################################################################################
 
-                    print(f'\tINCLUDING {processing_file} DATA FROM FILE: {data_filename}')
+            ##################################################################################
+            # ADD DATA [36DATA] AS NDARRAY (TIME SERIES)
+            ##################################################################################
+            behavior_module.add(data36_time_series.result())
+            ##################################################################################
 
-                ##################################################################################
-                # ADD ANALYSIS DATA REF AS TUPLE
-                ##################################################################################
-                analysis_file = row.analysis_file
-                name = 'behavioral_booleans'
-                description = 'Annotated masks for pre-defined behaviors (usable, head-torso, both)'
+            ##################################################################################
+            # ADD OTHER META-DATA [LCmat] AS NDARRAY (TIME SERIES)
+            ##################################################################################
+            behavior_module.add(labchart_time_series.result())
 
-                if analysis_file:
-                    data_filename = Path(*path_stub, analysis_file)
-                    analysis_data = behavior.add_matrix_data(data_filename, 'analysis', description)
+            ##################################################################################
+            # ADD PROCESSING DATA REF AS TUPLE
+            ##################################################################################
+            processing_file = row.processing_file
+            description = 'Percentiles of the 36-data signals.'
 
-                    behavior_module = nwbfile.create_processing_module(
-                        name=name, description=description
-                    )
-                    behavior_module.add(analysis_data)
+            if processing_file:
+                data_filename = session_path / processing_file
+                processing_data = behavior.add_matrix_data(data_filename, 'processing', description, compressor=args.compressor, backend=args.backend)
+                behavior_module.add(processing_data)
 
-                    print(f'\tINCLUDING {analysis_file} DATA FROM FILE: {data_filename}')
+                print(f'\tINCLUDING {processing_file} DATA FROM FILE: {data_filename}')
 
-            # WRITE NWB FILE TO STORAGE
-            print(f'\tWRITING NWB FILE TO STORAGE: {dest_path}')
-            with pynwb.NWBHDF5IO(dest_path, 'w') as io:
+            ##################################################################################
+            # ADD ANALYSIS DATA REF AS TUPLE
+            ##################################################################################
+            analysis_file = row.analysis_file
+            description = 'Annotated masks for pre-defined behaviors (usable, head-torso, both)'
+
+            if analysis_file:
+                data_filename = session_path / analysis_file
+                analysis_data = behavior.add_matrix_data(data_filename, 'analysis', description, compressor=args.compressor, backend=args.backend)
+                behavior_module.add(analysis_data)
+
+                print(f'\tINCLUDING {analysis_file} DATA FROM FILE: {data_filename}')
+
+        # WRITE NWB FILE TO STORAGE
+        if args.backend == 'zarr':
+            #ZARR STORE (DIRECTORY); CHUNKS ARE COMPRESSED INDEPENDENTLY, SO LARGE SESSIONS ARE NOT BOUND TO ONE HDF5 WRITER
+            #WRITE TO A TEMPORARY NAME AND RENAME WHEN COMPLETE; A CRASHED WRITE NEVER LOOKS LIKE AN UP-TO-DATE OUTPUT
+            print(f'\tWRITING NWB (ZARR) STORE TO STORAGE: {dest_path.with_suffix(".zarr")}')
+            tmp_path = dest_path.with_suffix('.zarr.tmp')
+            with NWBZarrIO(str(tmp_path), mode='w') as io:
                 io.write(nwbfile)
+            os.replace(tmp_path, dest_path.with_suffix('.zarr'))
+        else:
+            print(f'\tWRITING NWB FILE TO STORAGE: {dest_path}')
+            tmp_path = dest_path.with_suffix('.nwb.tmp')
+            with h5py.File(tmp_path, 'w', rdcc_nbytes=h5_cache_bytes, rdcc_nslots=h5_cache_slots,
+                           fs_strategy='page', fs_page_size=h5_page_size) as h5_out:
+                with pynwb.NWBHDF5IO(mode='w', file=h5_out) as io:
+                    io.write(nwbfile)
+            os.replace(tmp_path, dest_path)
 
+        
             
-                
-        else:
-            print("not complete")
-
-
-        #
-        #     #check if optical_channel1 is used
-        #     if str(dataset["optical_channel_name"]) != 'nan':
-        #         optical_channel = OpticalChannel(
-        #             name = dataset['optical_channel_name'],
-        #             description = dataset['optical_channel_description'],
-        #             emission_lambda = float(dataset['optical_channel_emission_lambda'])
-        #         )
-        #         imaging_plane = nwbfile.create_imaging_plane(
-        #             name = dataset['image_stack_name'],
-        #             description=dataset['image_stack_description'],
-        #             device = device,
-        #             optical_channel = optical_channel,
-        #             imaging_rate = float(dataset['image_stack_imaging_rate']),
-        #             excitation_lambda = float(dataset['image_stack_exitation_lambda']),
-        #             indicator = dataset['image_stack_indicator'],
-        #             location = dataset['image_stack_location'],
-        #             grid_spacing = literal_eval(dataset['image_stack_grid_spacing']),
-        #             grid_spacing_unit = dataset['image_stack_grid_spacing_unit']
-        #         )
-        #
-        #     ##################################################################################
-        #     #ADD FILE DATA (IMAGE STACK)
-        #
-        #
-        #
-        #     data = tifffile.imread(input_filename)
-        #     rate = float(dataset['image_stack_imaging_rate'])
-        #
-        #     image_series = TwoPhotonSeries(
-        #         name='TwoPhotonSeries',
-        #         data = data,
-        #         imaging_plane=imaging_plane,
-        #         rate=rate,
-        #         unit='NA',
-        #     )
-        #
-        #     nwbfile.add_acquisition(image_series)
-        #
-        #     ##################################################################################
-        #     #WRITE NWB FILE TO STORAGE
-        #     with pynwb.NWBHDF5IO(dest_path, 'w') as io:
-        #         io.write(nwbfile)
-        #
-        #     ##################################################################################
-
-            #VALIDATE .NWB FILE (FOR COMPLIANCE WITH CURRENT SPEC)
-        #    print(f'VALIDATING OUTPUT FILE: {dest_path}')
-            #exec(open(f'nwbinspector {dest_path}').read())
-            #nwbinspector .. /../ output / run03_airpuff_hindlimb_40psi_200924_155523.nwb - -config
-            #dandi
+    else:
+        print("not complete")
+
+    #RELEASE THE v7.3 .mat HANDLE (OPENED ONCE PER SESSION, SHARED BY ALL KEYS); WORKERS HANDLE MANY SESSIONS
+    if mat_file is not None:
+        mat_file.close()
+
+
+    #
+    #     #check if optical_channel1 is used
+    #     if str(dataset["optical_channel_name"]) != 'nan':
+    #         optical_channel = OpticalChannel(
+    #             name = dataset['optical_channel_name'],
+    #             description = dataset['optical_channel_description'],
+    #             emission_lambda = float(dataset['optical_channel_emission_lambda'])
+    #         )
+    #         imaging_plane = nwbfile.create_imaging_plane(
+    #             name = dataset['image_stack_name'],
+    #             description=dataset['image_stack_description'],
+    #             device = device,
+    #             optical_channel = optical_channel,
+    #             imaging_rate = float(dataset['image_stack_imaging_rate']),
+    #             excitation_lambda = float(dataset['image_stack_exitation_lambda']),
+    #             indicator = dataset['image_stack_indicator'],
+    #             location = dataset['image_stack_location'],
+    #             grid_spacing = literal_eval(dataset['image_stack_grid_spacing']),
+    #             grid_spacing_unit = dataset['image_stack_grid_spacing_unit']
+    #         )
+    #
+    #     ##################################################################################
+    #     #ADD FILE DATA (IMAGE STACK)
+    #
+    #
+    #
+    #     data = tifffile.imread(input_filename)
+    #     rate = float(dataset['image_stack_imaging_rate'])
+    #
+    #     image_series = TwoPhotonSeries(
+    #         name='TwoPhotonSeries',
+    #         data = data,
+    #         imaging_plane=imaging_plane,
+    #         rate=rate,
+    #         unit='NA',
+    #     )
+    #
+    #     nwbfile.add_acquisition(image_series)
+    #
+    #     ##################################################################################
+    #     #WRITE NWB FILE TO STORAGE
+    #     with pynwb.NWBHDF5IO(dest_path, 'w') as io:
+    #         io.write(nwbfile)
+    #
+    #     ##################################################################################
+
+        #VALIDATE .NWB FILE (FOR COMPLIANCE WITH CURRENT SPEC)
+    #    print(f'VALIDATING OUTPUT FILE: {dest_path}')
+        #exec(open(f'nwbinspector {dest_path}').read())
+        #nwbinspector .. /../ output / run03_airpuff_hindlimb_40psi_200924_155523.nwb - -config
+        #dandi
+
 
+def main():
+    #################################################################
+    # APP CONSTANTS (DEFAULT)
+    researcher_experimenter = ""
+    institution = ""
+    experiment_modality = "1" #ephys
+    #################################################################
+    
 
+    if len(sys.argv) > 1:
+        args = collectArguments()
+        print("USING CLI ARGUMENTS")
+        print(f'ARGUMENTS COLLECTED: {args}')
+        experiment_modality = args.experiment_modality
     else:
-        print("MISSING ARGUMENTS; UNABLE TO CONTINUE")
+        print("MISSING ARGUMENTS; USING DEFAULTS")
         print(f'\'python {os.path.basename(__file__)} -h\' FOR HELP\n')
+        args.output_path = output_path
+        experiment_modality = experiment_modality
+        args.researcher_experimenter = researcher_experimenter
+        args.institution = institution
+        args.debug = debug
+    
+    if args.backend == 'zarr' and NWBZarrIO is None:
+        print("ZARR BACKEND REQUESTED BUT hdmf-zarr IS NOT INSTALLED; UNABLE TO CONTINUE")
+        exit()
+    if args.backend == 'zarr' and args.compressor == 'lzf':
+        print("LZF IS AN HDF5-ONLY FILTER; USE --compressor gzip, blosc, zstd OR none WITH THE ZARR BACKEND")
         exit()
 
+    lstRecords = load_data(args.input_file, experiment_modality)
+    
+    ##################################################################################
+    #RENAME EXCEL/DATAFRAME FIELD COLUMN NAMES FOR EASIER NWB CONVERSION
+    lstRecords.rename(columns={'session_start_time(YYYY-MM-DD HH:MM)': 'session_start_time'}, inplace=True)
+    lstRecords.rename(columns={'date_of_birth(YYYY-MM-DD)': 'date_of_birth'}, inplace=True)
+    lstRecords.rename(columns={'age(days)': 'age_days'}, inplace=True)
+    ##################################################################################
+
+    ##################################################################################
+    #NORMALIZE PER-SESSION META-DATA ONCE (COLUMN-WISE) BEFORE THE ROW LOOP
+    #IF NO TIMEZONE INFO, USE LOCAL TIMEZONE; MISSING/UNPARSABLE START TIMES DEFAULT TO NOW
+    local_tz = utils.local_tz
+    now = pd.Timestamp.now(tz=local_tz)
+    session_start_times = pd.to_datetime(lstRecords['session_start_time'], errors='coerce')
+    if session_start_times.dt.tz is None:
+        session_start_times = session_start_times.dt.tz_localize(local_tz, nonexistent='shift_forward', ambiguous='NaT')
+    session_start_times = session_start_times.fillna(now)
+
+    #DATE OF BIRTH: CALENDAR DATE (ITS OWN WALL-CLOCK Y/M/D) AT LOCAL MIDNIGHT; MISSING/UNPARSABLE -> None
+    dates_of_birth = pd.to_datetime(lstRecords['date_of_birth'], errors='coerce')
+    if dates_of_birth.dt.tz is not None:
+        dates_of_birth = dates_of_birth.dt.tz_localize(None)
+    dates_of_birth = dates_of_birth.dt.normalize().dt.tz_localize(local_tz, nonexistent='shift_forward', ambiguous='NaT')
+    dates_of_birth = dates_of_birth.astype(object).where(dates_of_birth.notna(), None)
+
+    unique_identifiers = utils.bulk_uuid4(len(lstRecords))
+    nwb_session_ids = lstRecords['session_id'].astype(str) + '_' + unique_identifiers
+    nwb_output_prefixes = lstRecords['session_id'].astype(str).str.translate(filename_sanitize_table) # REPLACE SLASHES/COLONS IN FILENAME WITH UNDERSCORE
+    lstRecords = lstRecords.assign(
+        sex=lstRecords['sex'].map({'Male': 'M', 'M': 'M', 'Female': 'F', 'F': 'F'}).fillna('U'),  # U = unknown
+        session_start_time=session_start_times,
+        date_of_birth=dates_of_birth,
+        nwb_session_id=nwb_session_ids,
+        nwb_output_prefix=nwb_output_prefixes,
+        nwb_output_filename=nwb_output_prefixes + '_' + unique_identifiers + '.nwb'
+    )
+
+    #TEXT META-DATA USED AS NWB NAMES/DESCRIPTIONS; CAST TO str ONCE (COLUMN-WISE) RATHER THAN AT EACH USE
+    text_fields = [field for field in ('sensor_description', 'device_name', 'device_description', 'device_manufacturer') if field in lstRecords.columns]
+    lstRecords = lstRecords.assign(**{field: lstRecords[field].map(str) for field in text_fields})
+
+    #STIMULUS/PHARMACOLOGY NOTES (NON-BEHAVIOR MODALITIES); INCLUDE FLAGS ARE 1 (include) OR 0 (do not include)
+    notes_fields = ['stimulus_notes_include', 'stimulus_notes_paradigm',
+                    'stimulus_notes_direct_electrical_stimulation', 'stimulus_notes_direct_electrical_stimulation_paradigm',
+                    'pharmacology_notes_anesthetized_during_recording', 'pharmacology']
+    if experiment_modality != "4":
+        notes = lstRecords.reindex(columns=notes_fields) #MISSING NOTES COLUMNS READ AS NaN (FLAG NOT 1 -> PART NOT INCLUDED)
+        include_stimulus = notes['stimulus_notes_include'] == 1
+        include_direct = include_stimulus & (notes['stimulus_notes_direct_electrical_stimulation'] == 1)
+        stimulus_notes = ("Stimulus paradigm: " + notes['stimulus_notes_paradigm'].map(str) + "; ").where(include_stimulus, 'NA')
+        direct_stimulation = ("Direct electrical stimulation paradigm: " + notes['stimulus_notes_direct_electrical_stimulation_paradigm'].map(str) + "; ").where(include_direct, '')
+        lstRecords = lstRecords.assign(
+            nwb_stimulus_notes=stimulus_notes + direct_stimulation,
+            nwb_pharmacology=notes['pharmacology'].where(notes['pharmacology_notes_anesthetized_during_recording'] == 1, 'NA')
+        )
+    ##################################################################################
+
+    ##################################################################################
+    #CREATE DIRECTORIES ONCE PER RUN; INDEX PRE-EXISTING NWB FILES ONCE BY (FOLDER, NUMERIC PREFIX)
+    created_dirs = set()
+    ensure_directory(Path(output_path), created_dirs)
+    existing_nwb_files = defaultdict(list)
+    for existing_file in Path(args.output_path).rglob('*.nwb'):
+        existing_nwb_files[(existing_file.parent, existing_file.name.split('_', 1)[0])].append(existing_file)
+    ##################################################################################
+
+    ##################################################################################
+    #SESSIONS ARE INDEPENDENT (ONE .nwb FILE EACH); CONVERT THEM IN PARALLEL, ONE PROCESS PER SESSION
+    #ROWS ARE EXTRACTED ONCE AS PLAIN DICTS (CHEAP TO PICKLE); ROWS WITHOUT A SESSION ID ARE MASKED OUT COLUMN-WISE
+    records = lstRecords.to_dict('records')
+    has_session_id = (lstRecords['session_id'].notna() & (lstRecords['session_id'].astype(str) != '')).to_numpy()
+    sessions = []
+    for cnt in np.flatnonzero(has_session_id).tolist():
+        row = records[cnt]
+        dest_folder = Path(args.output_path, str(Path(row['recordings_folder_directory']).parent.name))
+        ensure_directory(dest_folder, created_dirs)
+        existing_files = existing_nwb_files.get((dest_folder, str(cnt)), [])
+        sessions.append((cnt, row, existing_files))
+
+    if not sessions:
+        print("NO SESSIONS TO PROCESS")
+        return
+
+    max_workers = max(1, min(args.workers, len(sessions))) #HDF5 COMPRESSION/.mat DECODE ARE CPU-HEAVY; HALF THE CORES BY DEFAULT
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(process_session, cnt, row, args, experiment_modality, researcher_experimenter, institution, existing_files)
+                   for cnt, row, existing_files in sessions]
+        for future in futures:
+            future.result() #RE-RAISE ANY WORKER EXCEPTION IN THE PARENT
+    ##################################################################################
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
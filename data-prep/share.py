@@ -4,26 +4,30 @@
 
 '''IMPLEMENTS INTERFACE BETWEEN LOCAL EXPERIMENTAL DATA (AND META-DATA) AND REMOTE DATA SHARING PORTAL FOR U19 GRANT INSTITUTIONS'''
 
-import os, sys, math, time, pynwb
-from pynwb.ophys import OpticalChannel, TwoPhotonSeries, ImagingPlane
+import os, sys, math, time
 import argparse
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 from dateutil.tz import tzlocal
 from pathlib import Path
-from ast import literal_eval
-import tifffile
+from concurrent.futures import ProcessPoolExecutor
 
 #################################################################
 # APP CONSTANTS (DEFAULT)
-output_path = Path(os.getcwd(), 'output')
+cwd_path = Path.cwd() #RESOLVED ONCE; INPUT PATHS IN THE SHEET ARE RELATIVE TO IT
+output_path = cwd_path / 'output'
 # debug = True
 
 experimenter = 'Yao, Pantong'
 institution = 'UC San Diego'
 experiment_description = None #string or null
 keywords = ['Researchers: ' + str(experimenter)]
+local_tz = tzlocal() #RESOLVE LOCAL TIMEZONE ONCE; SHARED BY ALL PER-DATASET TIMESTAMPS
+session_start_time = datetime(2023, 3, 2, tzinfo=local_tz) #SAME (FIXED) START TIME FOR EVERY DATASET
+target_chunk_bytes = 1024 * 1024 #~1 MiB HDF5 CHUNKS OF WHOLE FRAMES
+h5_cache_bytes = 64 * 1024 * 1024 #HDF5 RAW CHUNK CACHE (BYTES) FOR OUTPUT FILES
+h5_cache_slots = 100003 #PRIME; HASH SLOTS FOR CHUNK CACHE
 #################################################################
 
 def displayMenu():
@@ -33,6 +37,8 @@ def displayMenu():
 def collectArguments():
     argParser = argparse.ArgumentParser()
     argParser.add_argument("-i", "--input_file", help="Input file (.xlsx) containing experimental parameters/data locations")
+    argParser.add_argument("-workers", "--workers", help="Number of datasets converted in parallel (default: half the CPU cores)", type=int, default=max(1, (os.cpu_count() or 1) // 2))
+    argParser.add_argument("-force", "--force", help="Rewrite NWB outputs even when they are newer than their image stack and the meta-data sheet", action="store_true")
     args = argParser.parse_args()
     return args
 
@@ -84,25 +90,49 @@ def load_data(input_file):
         'image_stack_grid_spacing_unit'
     ]  # headers I need
 
-    lstExtractionFields = pd.read_excel(input_file, sheet_name="auto", usecols=lstNWBFields) #just extract columns/fields I need
+    #PARSED COLUMNS ARE CACHED AS PARQUET NEXT TO THE .xlsx AND REUSED UNTIL THE WORKBOOK IS MODIFIED
+    cache_file = Path(input_file).with_suffix('.share.parquet')
+    if cache_file.exists() and cache_file.stat().st_mtime >= Path(input_file).stat().st_mtime:
+        print(f'READING CACHED META-DATA: {cache_file}')
+        return pd.read_parquet(cache_file)
+
+    try: #calamine (RUST) PARSER IS MUCH FASTER THAN openpyxl FOR VALUE-ONLY READS
+        lstExtractionFields = pd.read_excel(input_file, sheet_name="auto", usecols=lstNWBFields, engine="calamine") #just extract columns/fields I need
+    except ImportError: #python-calamine IS OPTIONAL
+        lstExtractionFields = pd.read_excel(input_file, sheet_name="auto", usecols=lstNWBFields)
+    try:
+        lstExtractionFields.to_parquet(cache_file, compression='zstd')
+    except Exception as e: #CACHE IS BEST-EFFORT (E.G. pyarrow MISSING, MIXED-TYPE COLUMNS, READ-ONLY FOLDER)
+        print(f'WARNING: UNABLE TO CACHE META-DATA ({e})')
+        cache_file.unlink(missing_ok=True)
     return lstExtractionFields
 
 
-def get_subject(age, subject_description, genotype, sex, species, subject_id, subject_weight, date_of_birth, subject_strain):
-    '''Used for meta-data '''
-    if isinstance(age, str) != True:
-        try:
-            subject_age = "P" + str(int(age)) + "D" #ISO 8601 Duration format - assumes 'days'
-        except:
-            subject_age = "P0D" #generic
+def parse_grid_spacing(value):
+    '''Parses a grid spacing cell such as "(2.0, 2.0, 30.0)" or "[2, 2]" into a tuple of floats'''
+    return tuple(float(x) for x in str(value).strip('()[] ').split(',') if x.strip())
 
-    dob = date_of_birth.to_pydatetime() #convert pandas timestamp to python datetime format
-    if isinstance(dob.year, int) and isinstance(dob.month, int) and isinstance(dob.day, int) == True:
-        date_of_birth = datetime(dob.year, dob.month, dob.day, tzinfo=tzlocal())
-    else:
-        date_of_birth = None
 
-    subject = pynwb.file.Subject(age=subject_age,
+def normalize_subject_fields(records):
+    '''Column-wise: age already in ISO 8601 form ("P...D") kept as-is, other ages -> "P<days>D" (P0D if missing/non-numeric);
+    date of birth -> local-midnight timestamp or None'''
+    iso_ages = records['age'].astype(str).str.match(r'^P.*D$')
+    day_ages = "P" + pd.to_numeric(records['age'].where(~iso_ages), errors='coerce').fillna(0).astype(int).astype(str) + "D" #ISO 8601 Duration format - assumes 'days'
+    dates_of_birth = pd.to_datetime(records['date_of_birth(YYYY-MM-DD)'], errors='coerce')
+    if dates_of_birth.dt.tz is not None:
+        dates_of_birth = dates_of_birth.dt.tz_localize(None)
+    dates_of_birth = dates_of_birth.dt.normalize().dt.tz_localize(local_tz, nonexistent='shift_forward', ambiguous='NaT')
+    return records.assign(**{
+        'age': records['age'].where(iso_ages, day_ages),
+        'date_of_birth(YYYY-MM-DD)': dates_of_birth.astype(object).where(dates_of_birth.notna(), None),
+    })
+
+
+def get_subject(age, subject_description, genotype, sex, species, subject_id, subject_weight, date_of_birth, subject_strain):
+    '''Used for meta-data '''
+    import pynwb.file
+    #age (ISO 8601 DURATION) AND date_of_birth (LOCAL MIDNIGHT OR None) ARE NORMALIZED COLUMN-WISE IN normalize_subject_fields
+    subject = pynwb.file.Subject(age=age,
                              description=subject_description,
                              genotype=str(genotype),
                              sex=sex,
@@ -115,134 +145,189 @@ def get_subject(age, subject_description, genotype, sex, species, subject_id, su
     return subject
 
 
+def process_dataset(cnt, dataset, source_mtime=None):
+    '''Converts a single dataset (spreadsheet row) to NWB; runs in a worker process so must be top-level (picklable)
+    Skipped when the output is at least as new as the image stack and source_mtime (meta-data sheet); None always converts'''
+    #HEAVY IMPORTS AT FUNCTION SCOPE (LOADED ONCE PER WORKER); --help AND ERROR PATHS EXIT WITHOUT pynwb NAMESPACE PARSING
+    import pynwb
+    import tifffile
+    import h5py
+    from pynwb import H5DataIO
+    from pynwb.ophys import OpticalChannel, TwoPhotonSeries
+    from hdmf.data_utils import DataChunkIterator
+
+    print(f"PROCESSING DATASET #{cnt + 1}")
+    print(f"\tsession_id: {dataset['session_id']}")
+    age = dataset['age']
+    subject_description = dataset['subject_description']
+    genotype = dataset['genotype']
+    if dataset['sex'] == 'Male':
+        sex = 'M'
+    elif dataset['sex'] == 'Female':
+        sex = 'F'
+    else:
+        sex = 'U'  # unknown
+    species = dataset['species']
+    subject_id = dataset['subject_id']
+    subject_weight = dataset['subject_weight']
+    date_of_birth = dataset['date_of_birth(YYYY-MM-DD)']
+    subject_strain = dataset['subject_strain']
+
+    ##################################################################################
+    # CREATE EXPERIMENTAL SUBJECT OBJECT
+    subject = get_subject(age,
+                          subject_description,
+                          genotype,
+                          sex,
+                          species,
+                          subject_id,
+                          subject_weight,
+                          date_of_birth,
+                          subject_strain)
+    ##################################################################################
+
+    ##################################################################################
+    output_filename = None
+    session_id = dataset['session_id']
+    filename = Path(session_id)  # wrong extension; replace with 'nwb'
+    output_filename = filename.with_suffix('.nwb')
+    dest_path = output_path / output_filename
+
+    print(f'\tOUTPUT FILE: {dest_path}')
+
+    input_filename = cwd_path / dataset['src_folder_directory']
+    print(f'\tINPUT FILE: {input_filename}')
+
+    if source_mtime is not None and dest_path.exists():
+        output_mtime = dest_path.stat().st_mtime
+        if output_mtime >= source_mtime and output_mtime >= input_filename.stat().st_mtime:
+            print(f'\tNWB FILE UP TO DATE (USE --force TO REWRITE): {dest_path}')
+            return
+    ##################################################################################
+
+    ##################################################################################
+    #CREATE NWB FILE (BASIC META-DATA)
+    nwbfile = pynwb.NWBFile(session_description = dataset['session_description'],
+                            identifier = '',  # 1-DEC-2022 mod
+                            session_start_time = session_start_time,
+                            experiment_description = experiment_description,
+                            keywords = keywords,
+                            # surgery=None,  # add: Duane 17-NOV-2022
+                            # pharmacology=pharmacology,  # add: Duane 17-NOV-2022
+                            # stimulus_notes=stimulus_notes,  # add: Duane 18-NOV-2022
+                            experimenter = experimenter,
+                            institution = institution,
+                            subject=subject
+                            )
+
+    ##################################################################################
+    #ADD CONTAINER TO STORE IMAGE STACK DATA
+    device = nwbfile.create_device(
+        name = dataset['device_name'],
+        description = dataset['device_description'],
+        manufacturer = dataset['device_manufacturer']
+    )
+
+    #check if optical_channel1 is used
+    if str(dataset["optical_channel_name"]) != 'nan':
+        optical_channel = OpticalChannel(
+            name = dataset['optical_channel_name'],
+            description = dataset['optical_channel_description'],
+            emission_lambda = float(dataset['optical_channel_emission_lambda'])
+        )
+        imaging_plane = nwbfile.create_imaging_plane(
+            name = dataset['image_stack_name'],
+            description=dataset['image_stack_description'],
+            device = device,
+            optical_channel = optical_channel,
+            imaging_rate = float(dataset['image_stack_imaging_rate']),
+            excitation_lambda = float(dataset['image_stack_exitation_lambda']),
+            indicator = dataset['image_stack_indicator'],
+            location = dataset['image_stack_location'],
+            grid_spacing = parse_grid_spacing(dataset['image_stack_grid_spacing']),
+            grid_spacing_unit = dataset['image_stack_grid_spacing_unit']
+        )
+
+    ##################################################################################
+    #ADD FILE DATA (IMAGE STACK)
+
+
+
+    rate = float(dataset['image_stack_imaging_rate'])
+
+    #STREAM FRAMES (ALONG AXIS 0 OF THE SERIES) INTO THE NWB WRITE INSTEAD OF LOADING THE WHOLE STACK; FILE STAYS OPEN UNTIL WRITTEN
+    with tifffile.TiffFile(input_filename) as tif:
+        series = tif.series[0]
+        #SERIES SHAPE (NOT PAGE COUNT) IS THE STACK SHAPE: HYPERSTACKS HOLD SEVERAL PAGES PER FRAME, TRUNCATED (>4 GiB) IMAGEJ STACKS ONE PAGE IN TOTAL
+        stack_shape = tuple(series.shape)
+        frame_shape = stack_shape[1:]
+        try:
+            import zarr #OPTIONAL; series.aszarr() READS ANY AXIS-0 SLICE OF THE SERIES WITHOUT DECODING THE REST
+        except ModuleNotFoundError:
+            zarr = None
+        if zarr is not None:
+            stack = zarr.open(series.aszarr(), mode='r')
+            frame_iter = (stack[i] for i in range(stack_shape[0]))
+        elif len(series.pages) == stack_shape[0] and tuple(series.pages[0].shape) == frame_shape:
+            frame_iter = (page.asarray() for page in series.pages) #ONE PAGE PER FRAME
+        else:
+            raise ValueError(f'TIFF series shape {stack_shape} does not map to its {len(series.pages)} pages one frame per page; install zarr to stream {input_filename}')
+        frame_bytes = np.dtype(series.dtype).itemsize * int(np.prod(frame_shape))
+        frames_per_chunk = max(1, target_chunk_bytes // max(1, frame_bytes))
+
+        #CHUNKED + COMPRESSED (NOT CONTIGUOUS); EACH CHUNK HOLDS WHOLE FRAMES, ~target_chunk_bytes
+        frames = DataChunkIterator(data=frame_iter,
+                                   maxshape=stack_shape,
+                                   dtype=series.dtype,
+                                   buffer_size=frames_per_chunk)
+        data_io = H5DataIO(data=frames, chunks=(min(frames_per_chunk, stack_shape[0]),) + frame_shape,
+                           compression='gzip', compression_opts=4, shuffle=True)
+
+        image_series = TwoPhotonSeries(
+            name='TwoPhotonSeries',
+            data = data_io,
+            imaging_plane=imaging_plane,
+            rate=rate,
+            unit='NA',
+        )
+
+        nwbfile.add_acquisition(image_series)
+
+        ##################################################################################
+        #WRITE NWB FILE TO STORAGE
+        #LARGER CHUNK CACHE (DEFAULT IS 1 MiB) AVOIDS EVICTION CHURN WHILE FRAMES STREAM IN; NWBHDF5IO WRITES THROUGH THE HANDLE
+        #WRITE TO A TEMPORARY NAME AND RENAME WHEN COMPLETE; A CRASHED WRITE NEVER LOOKS LIKE AN UP-TO-DATE OUTPUT
+        tmp_path = dest_path.with_suffix('.nwb.tmp')
+        with h5py.File(tmp_path, 'w', rdcc_nbytes=h5_cache_bytes, rdcc_nslots=h5_cache_slots, rdcc_w0=0.75) as h5_out:
+            with pynwb.NWBHDF5IO(mode='w', file=h5_out) as io:
+                io.write(nwbfile)
+        os.replace(tmp_path, dest_path)
+
+    ##################################################################################
+
+    #VALIDATE .NWB FILE (FOR COMPLIANCE WITH CURRENT SPEC)
+    print(f'VALIDATING OUTPUT FILE: {dest_path}')
+    #exec(open(f'nwbinspector {dest_path}').read())
+    #nwbinspector .. /../ output / run03_airpuff_hindlimb_40psi_200924_155523.nwb - -config
+    #dandi
+
+
 def main():
     displayMenu()
     if len(sys.argv) > 1:
         args = collectArguments()
         displayParam(args)
 
-        lstRecords = load_data(args.input_file).to_dict('records')  # creates list of dictionaries
-
-        for cnt, dataset in enumerate(lstRecords):
-            print(f"PROCESSING DATASET #{cnt + 1}")
-            print(f"\tsession_id: {dataset['session_id']}")
-            age = dataset['age']
-            subject_description = dataset['subject_description']
-            genotype = dataset['genotype']
-            if dataset['sex'] == 'Male':
-                sex = 'M'
-            elif dataset['sex'] == 'Female':
-                sex = 'F'
-            else:
-                sex = 'U'  # unknown
-            species = dataset['species']
-            subject_id = dataset['subject_id']
-            subject_weight = dataset['subject_weight']
-            date_of_birth = dataset['date_of_birth(YYYY-MM-DD)']
-            subject_strain = dataset['subject_strain']
-
-            ##################################################################################
-            # CREATE EXPERIMENTAL SUBJECT OBJECT
-            subject = get_subject(age,
-                                  subject_description,
-                                  genotype,
-                                  sex,
-                                  species,
-                                  subject_id,
-                                  subject_weight,
-                                  date_of_birth,
-                                  subject_strain)
-            ##################################################################################
-
-            ##################################################################################
-            output_filename = None
-            session_id = dataset['session_id']
-            filename = Path(session_id)  # wrong extension; replace with 'nwb'
-            output_filename = filename.with_suffix('.nwb')
-            dest_path = Path(output_path, output_filename)
-
-            Path(output_path).mkdir(parents=True, exist_ok=True)
-
-            print(f'\tOUTPUT FILE: {dest_path}')
-
-            input_filename = Path(os.getcwd(), dataset['src_folder_directory'])
-            print(f'\tINPUT FILE: {input_filename}')
-            ##################################################################################
-
-            ##################################################################################
-            #CREATE NWB FILE (BASIC META-DATA)
-            nwbfile = pynwb.NWBFile(session_description = dataset['session_description'],
-                                    identifier = '',  # 1-DEC-2022 mod
-                                    session_start_time = datetime(2023, 3, 2, tzinfo=tzlocal()),
-                                    experiment_description = experiment_description,
-                                    keywords = keywords,
-                                    # surgery=None,  # add: Duane 17-NOV-2022
-                                    # pharmacology=pharmacology,  # add: Duane 17-NOV-2022
-                                    # stimulus_notes=stimulus_notes,  # add: Duane 18-NOV-2022
-                                    experimenter = experimenter,
-                                    institution = institution,
-                                    subject=subject
-                                    )
-
-            ##################################################################################
-            #ADD CONTAINER TO STORE IMAGE STACK DATA
-            device = nwbfile.create_device(
-                name = dataset['device_name'],
-                description = dataset['device_description'],
-                manufacturer = dataset['device_manufacturer']
-            )
-
-            #check if optical_channel1 is used
-            if str(dataset["optical_channel_name"]) != 'nan':
-                optical_channel = OpticalChannel(
-                    name = dataset['optical_channel_name'],
-                    description = dataset['optical_channel_description'],
-                    emission_lambda = float(dataset['optical_channel_emission_lambda'])
-                )
-                imaging_plane = nwbfile.create_imaging_plane(
-                    name = dataset['image_stack_name'],
-                    description=dataset['image_stack_description'],
-                    device = device,
-                    optical_channel = optical_channel,
-                    imaging_rate = float(dataset['image_stack_imaging_rate']),
-                    excitation_lambda = float(dataset['image_stack_exitation_lambda']),
-                    indicator = dataset['image_stack_indicator'],
-                    location = dataset['image_stack_location'],
-                    grid_spacing = literal_eval(dataset['image_stack_grid_spacing']),
-                    grid_spacing_unit = dataset['image_stack_grid_spacing_unit']
-                )
-
-            ##################################################################################
-            #ADD FILE DATA (IMAGE STACK)
-
-
-
-            data = tifffile.imread(input_filename)
-            rate = float(dataset['image_stack_imaging_rate'])
-
-            image_series = TwoPhotonSeries(
-                name='TwoPhotonSeries',
-                data = data,
-                imaging_plane=imaging_plane,
-                rate=rate,
-                unit='NA',
-            )
-
-            nwbfile.add_acquisition(image_series)
-
-            ##################################################################################
-            #WRITE NWB FILE TO STORAGE
-            with pynwb.NWBHDF5IO(dest_path, 'w') as io:
-                io.write(nwbfile)
-
-            ##################################################################################
-
-            #VALIDATE .NWB FILE (FOR COMPLIANCE WITH CURRENT SPEC)
-            print(f'VALIDATING OUTPUT FILE: {dest_path}')
-            #exec(open(f'nwbinspector {dest_path}').read())
-            #nwbinspector .. /../ output / run03_airpuff_hindlimb_40psi_200924_155523.nwb - -config
-            #dandi
+        lstRecords = normalize_subject_fields(load_data(args.input_file)).to_dict('records')  # creates list of dictionaries
 
+        #DATASETS ARE INDEPENDENT (ONE .nwb FILE EACH); CONVERT THEM IN PARALLEL, ONE PROCESS PER DATASET
+        Path(output_path).mkdir(parents=True, exist_ok=True)
+        max_workers = max(1, min(args.workers, len(lstRecords))) #TIFF DECODE + GZIP ARE CPU-HEAVY; HALF THE CORES BY DEFAULT
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            source_mtime = None if args.force else os.stat(args.input_file).st_mtime #META-DATA EDITS ALSO INVALIDATE OUTPUTS
+            futures = [executor.submit(process_dataset, cnt, dataset, source_mtime) for cnt, dataset in enumerate(lstRecords)]
+            for future in futures:
+                future.result() #RE-RAISE ANY WORKER EXCEPTION IN THE PARENT
 
     else:
         print("MISSING ARGUMENTS; UNABLE TO CONTINUE")
@@ -14,6 +14,20 @@ import pandas as pd
 import h5py
 from h5py import Dataset
 from pynwb.behavior import TimeSeries, BehavioralTimeSeries, BehavioralEvents
+from pynwb import H5DataIO
+from .utils import read_dataset
+try:
+    import hdf5plugin #OPTIONAL; REGISTERS BLOSC FILTER WITH HDF5
+except ModuleNotFoundError:
+    hdf5plugin = None
+try:
+    import numcodecs #OPTIONAL; ONLY NEEDED FOR THE ZARR BACKEND (INSTALLED WITH hdmf-zarr)
+    from hdmf_zarr.utils import ZarrDataIO
+except ModuleNotFoundError:
+    numcodecs = None
+    ZarrDataIO = None
+
+small_dataset_bytes = 256 * 1024 #NUMERIC MATRICES BELOW THIS ARE WRITTEN CONTIGUOUS + UNCOMPRESSED
 
 
 def get_video_reference_data(src_file_with_path, nwb_folder_directory, symbolic_link=False):
@@ -26,9 +40,8 @@ def get_video_reference_data(src_file_with_path, nwb_folder_directory, symbolic_
     :return: relative reference to video file [relative to nwb location]
     '''
 
-    output_path_stub = nwb_folder_directory.parts[:-1]
-    ext_files_path = Path(*output_path_stub, 'external_files')
-    Path(ext_files_path).mkdir(parents=True, exist_ok=True)
+    ext_files_path = Path(nwb_folder_directory).parent / 'external_files'
+    ext_files_path.mkdir(parents=True, exist_ok=True)
 
     src_filename = os.path.basename(os.path.normpath(src_file_with_path))
     dest_file_with_path = Path(ext_files_path, src_filename)
@@ -71,18 +84,57 @@ def extract_img_series_data(mat_file):
     titles = ['a', 'b', 'phi', 'X0', 'Y0', 'X0_in', 'Y0_in', 'long_axis', 'short_axis']
 
     if Path(mat_file).is_file():
-        param = loadmat(mat_file)['ellipse_params'].tolist()
+        #READ ONLY THE ellipse_params VARIABLE; INDEX THE STRUCT RECORD DIRECTLY (NO NESTED-LIST CONVERSION)
+        param = loadmat(mat_file, variable_names=['ellipse_params'])['ellipse_params'][0, 0]
 
         for i in range(9):
             var_name = titles[i]
-            var_val = str(param[0][0][i][0][0])
+            var_val = str(param[i][0][0])
             img_comments += var_name + ':' + var_val + '; '
     else:
         print(f'\tCOMMENTS FOR VIDEO FILE NOT INCLUDED')
     return img_comments
 
 
-def add_timeseries_data(data, video_sampling_rate_Hz, name, description):
+def get_compression_options(compressor):
+    '''H5DataIO keyword arguments for compressor: gzip, blosc (lz4 + bitshuffle), zstd (blosc zstd + bitshuffle), lzf or none; blosc/zstd fall back to gzip if hdf5plugin missing'''
+    if compressor == 'blosc' and hdf5plugin is not None:
+        return dict(hdf5plugin.Blosc(cname='lz4', clevel=5, shuffle=hdf5plugin.Blosc.BITSHUFFLE), allow_plugin_filters=True)
+    elif compressor == 'zstd' and hdf5plugin is not None:
+        return dict(hdf5plugin.Blosc(cname='zstd', clevel=3, shuffle=hdf5plugin.Blosc.BITSHUFFLE), allow_plugin_filters=True)
+    elif compressor == 'lzf':
+        return dict(compression='lzf', shuffle=True)
+    elif compressor == 'none':
+        return {}
+    return dict(compression='gzip', compression_opts=4, shuffle=True)
+
+
+def get_zarr_compression_options(compressor):
+    '''ZarrDataIO keyword arguments for compressor (numcodecs equivalents of get_compression_options); lzf has no Zarr codec'''
+    if compressor == 'blosc':
+        return dict(compressor=numcodecs.Blosc(cname='lz4', clevel=5, shuffle=numcodecs.Blosc.BITSHUFFLE))
+    elif compressor == 'zstd':
+        return dict(compressor=numcodecs.Blosc(cname='zstd', clevel=3, shuffle=numcodecs.Blosc.BITSHUFFLE))
+    elif compressor == 'gzip':
+        return dict(compressor=numcodecs.GZip(level=4))
+    elif compressor == 'none':
+        return dict(compressor=False)
+    raise ValueError(f"Compressor '{compressor}' is not available for the zarr backend (use gzip, blosc, zstd or none)")
+
+
+def wrap_chunked(data, target_chunk_bytes=1024 * 1024, compressor='gzip', backend='hdf5'):
+    '''Wraps numeric array data in H5DataIO (or ZarrDataIO for backend='zarr'): ~1 MiB chunks of whole rows, compressed (non-numeric data returned as-is)'''
+    arr = np.asarray(data)
+    if arr.ndim == 0 or arr.size == 0 or arr.dtype.kind not in 'biuf':
+        return data
+    row_bytes = max(1, arr.itemsize * int(np.prod(arr.shape[1:])))
+    chunk_rows = min(arr.shape[0], max(1, target_chunk_bytes // row_bytes))
+    if backend == 'zarr': #NWBZarrIO IGNORES H5DataIO SETTINGS
+        return ZarrDataIO(data=arr, chunks=(chunk_rows,) + arr.shape[1:], **get_zarr_compression_options(compressor))
+    return H5DataIO(data=arr, chunks=(chunk_rows,) + arr.shape[1:], **get_compression_options(compressor))
+
+
+def add_timeseries_data(data, video_sampling_rate_Hz, name, description, container_name="BehavioralTimeSeries", compressor='gzip', backend='hdf5'):
     """
     Creates a NWB TimeSeries or BehavioralTimeSeries from various input types.
     Supports:
@@ -91,6 +143,8 @@ def add_timeseries_data(data, video_sampling_rate_Hz, name, description):
     - .xlsx/.mat files
     - list of 1D NumPy arrays
     - h5py.Dataset
+    container_name must be unique when several results share one processing module.
+    compressor selects the HDF5 filter (see get_compression_options), or the Zarr codec when backend is 'zarr'.
     """
     print(f"Processing data for: {name}")
     unit = 'NA'
@@ -180,7 +234,7 @@ def add_timeseries_data(data, video_sampling_rate_Hz, name, description):
 
     # === CASE 3: h5py.Dataset ===
     elif isinstance(data, Dataset):
-        nd_array_timeseries_data = data[()].squeeze()
+        nd_array_timeseries_data = read_dataset(data).squeeze()
 
     # === CASE 4: file path (.xlsx, .mat) ===
     elif isinstance(data, (str, bytes, os.PathLike)):
@@ -191,7 +245,13 @@ def add_timeseries_data(data, video_sampling_rate_Hz, name, description):
             nd_array_timeseries_data = pd.read_excel(file).to_numpy()
 
         elif file_extension == '.mat':
-            mat_data = loadmat(file)
+            mat_keys = ['data', 'datastart', 'dataend']
+            if h5py.is_hdf5(file):
+                #v7.3 (HDF5) .mat: READ THE ARRAYS DIRECTLY; MATLAB IS COLUMN-MAJOR SO TRANSPOSE BACK TO MATLAB ORIENTATION
+                with h5py.File(file, 'r') as mat_h5:
+                    mat_data = {key: read_dataset(mat_h5[key]).T for key in mat_keys if key in mat_h5}
+            else:
+                mat_data = loadmat(file, variable_names=mat_keys) #ONLY THE VARIABLES USED BELOW
             nd_array_timeseries_data = mat_data['data']
             if nd_array_timeseries_data.shape[0] == 1:
                 nd_array_timeseries_data = nd_array_timeseries_data.T
@@ -224,7 +284,7 @@ def add_timeseries_data(data, video_sampling_rate_Hz, name, description):
     # === Create NWB TimeSeries ===
     timeseries = TimeSeries(
         name=name,
-        data=nd_array_timeseries_data,
+        data=wrap_chunked(nd_array_timeseries_data, compressor=compressor, backend=backend),
         rate=float(video_sampling_rate_Hz),
         description=str(description),
         unit=str(unit)
@@ -232,14 +292,14 @@ def add_timeseries_data(data, video_sampling_rate_Hz, name, description):
 
     behavioral_time_series = BehavioralTimeSeries(
         time_series=timeseries,
-        name="BehavioralTimeSeries"
+        name=container_name
     )
 
     return behavioral_time_series
 
 
-def add_matrix_data(file, name, description):
-    '''NOT REALLY TIMESERIES, JUST A HACK TO ADD MATRIX DATA TO NWB CONTAINER'''
+def add_matrix_data(file, name, description, compressor='gzip', backend='hdf5'):
+    '''NOT REALLY TIMESERIES, JUST A HACK TO ADD MATRIX DATA TO NWB CONTAINER (compressor/backend: see wrap_chunked)'''
 
     file_extension = Path(file).suffix
 
@@ -251,6 +311,12 @@ def add_matrix_data(file, name, description):
         data = bools
 
     unit = 'NA'
+    arr = np.asarray(data)
+    if arr.dtype.kind in 'biuf' and arr.nbytes < small_dataset_bytes:
+        #TINY TABLES: NO FILTER PIPELINE / CHUNK INDEX, JUST CONTIGUOUS STORAGE (ZARR: ONE UNCOMPRESSED CHUNK)
+        data = ZarrDataIO(data=arr, chunks=arr.shape, compressor=False) if backend == 'zarr' else H5DataIO(data=arr, compression=None, chunks=None)
+    else:
+        data = wrap_chunked(data, compressor=compressor, backend=backend)
     container = TimeSeries(
         name=name,
         data=data,
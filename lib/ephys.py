@@ -6,6 +6,7 @@
 
 import numpy as np
 import h5py
+from pynwb.ecephys import ElectricalSeries
 
 
 def process_spike_data(ref_array, mat_file):
@@ -43,6 +44,18 @@ def process_spike_data(ref_array, mat_file):
     return all_clusters
 
 
+def process_ephys(ref_array, nwbfile, ephys_device, mat_file):
+    """Adds spike-sorted clusters (electrode table + ElectricalSeries) to nwbfile"""
+    spike_sorted_clusters_data = process_spike_data(ref_array, mat_file)
+    create_electrode_table(nwbfile, spike_sorted_clusters_data, ephys_device)
+
+    # Create ElectricalSeries
+    electrical_series = create_electrical_series(nwbfile, spike_sorted_clusters_data)
+    nwbfile.add_acquisition(electrical_series)
+
+    print(f"Processed {len(spike_sorted_clusters_data)} spike clusters")
+
+
 def create_electrode_table(nwbfile, all_clusters, ephys_device):
     """Create electrode table from cluster data"""
     
@@ -66,20 +79,12 @@ def create_electrode_table(nwbfile, all_clusters, ephys_device):
 def create_electrical_series(nwbfile, all_clusters, sampling_rate=30000.0):
     """Create ElectricalSeries from spike data"""
     
-    # Aggregate all spike data
-    all_spike_times = []
-    all_sites = []
-    all_waveforms = []
-    
-    for cluster in all_clusters:
-        # Convert samples to seconds
-        spike_times = cluster['spike_times'] / sampling_rate
-        all_spike_times.extend(spike_times)
-        all_sites.extend([cluster['site']] * len(spike_times))
-        
-        # Collect waveforms
-        if 'waveforms' in cluster:
-            all_waveforms.append(cluster['waveforms'])
+    # Aggregate all spike data (one concatenate/repeat instead of per-spike list appends)
+    cluster_spike_times = [np.ravel(cluster['spike_times']) for cluster in all_clusters]
+    spike_counts = [len(spike_times) for spike_times in cluster_spike_times]
+    all_spike_times = np.concatenate(cluster_spike_times) / sampling_rate if all_clusters else np.array([])  # Convert samples to seconds
+    all_sites = np.repeat([cluster['site'] for cluster in all_clusters], spike_counts).tolist()
+    all_waveforms = [cluster['waveforms'] for cluster in all_clusters if 'waveforms' in cluster]
     
     # Create electrode table region
     electrode_region = nwbfile.create_electrode_table_region(
@@ -93,7 +98,7 @@ def create_electrical_series(nwbfile, all_clusters, sampling_rate=30000.0):
         name='spike_waveforms',
         data=np.vstack(all_waveforms) if all_waveforms else None,
         electrodes=electrode_region,
-        timestamps=np.array(all_spike_times),
+        timestamps=all_spike_times,
         description='Sorted spike waveforms',
         comments=f'Contains {len(all_clusters)} sorted units',
         conversion=1.0,  # Update if needed
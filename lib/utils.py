@@ -7,6 +7,8 @@
 import sys
 from pathlib import Path
 import re
+import os
+import uuid
 from datetime import datetime
 from dateutil.tz import tzlocal
 import pandas as pd
@@ -16,6 +18,13 @@ import h5py
 import numpy as np 
 from scipy.io import loadmat
 from scipy.io.matlab import mat_struct
+from hdmf.data_utils import GenericDataChunkIterator
+
+
+local_tz = tzlocal() #RESOLVE LOCAL TIMEZONE ONCE; SHARED BY ALL PER-SESSION TIMESTAMPS
+mat_cache_bytes = 256 * 1024 * 1024 #HDF5 RAW CHUNK CACHE (BYTES) FOR v7.3 .mat READS
+mat_cache_slots = 1000003 #PRIME; HASH SLOTS FOR CHUNK CACHE
+mat_in_memory_max_bytes = 512 * 1024 * 1024 #SMALLER .mat FILES ARE READ FULLY INTO RAM (core DRIVER)
 
 
 def IsWin11():
@@ -34,6 +43,7 @@ def get_subject(age: int, subject_description: str, genotype: str, sex: str, spe
     elif isinstance(age, str) == True and re.search("^P*D$", age):  # STARTS WITH 'P' AND ENDS WITH 'D' (CORRECT FORMATTING)
         subject_age = age
         
+    dob = None  # DEFAULT VALUE (MISSING DATE OF BIRTH)
     if date_of_birth is not None:
         print(f"date_of_birth: {date_of_birth} ({type(date_of_birth)})")
         if isinstance(date_of_birth, pd.Timestamp):
@@ -48,7 +58,7 @@ def get_subject(age: int, subject_description: str, genotype: str, sex: str, spe
         
         # Normalize to just YMD with local timezone
         try:
-            dob = datetime(dob.year, dob.month, dob.day, tzinfo=tzlocal())
+            dob = datetime(dob.year, dob.month, dob.day, tzinfo=local_tz)
         except Exception as e:
             dob = None  # fallback if any error occurs in normalization
 
@@ -86,7 +96,11 @@ def extract_mat_data_by_key(input_filename: Path, revised_scratch_path: Path):
 
     # === Try modern HDF5-based MAT (v7.3) ===
     try:
-        mat_file = h5py.File(input_filename, 'r')  # Will remain open
+        #LARGE CHUNK CACHE AVOIDS RE-READING CHUNKS; SMALL FILES ARE LOADED INTO MEMORY SO RANDOM ACCESS IS CHEAP
+        open_kwargs = dict(rdcc_nbytes=mat_cache_bytes, rdcc_nslots=mat_cache_slots, rdcc_w0=0.75)
+        if Path(input_filename).stat().st_size <= mat_in_memory_max_bytes:
+            open_kwargs.update(driver='core', backing_store=False)
+        mat_file = h5py.File(input_filename, 'r', **open_kwargs)  # Will remain open
         print("Loaded as HDF5 (v7.3+) format")
 
         obj = mat_file['obj']
@@ -102,9 +116,9 @@ def extract_mat_data_by_key(input_filename: Path, revised_scratch_path: Path):
                         if subitem.dtype == 'object':
                             data_dict[key][subkey] = subitem  # Keep object refs
                         else:
-                            data_dict[key][subkey] = np.array(subitem)
+                            data_dict[key][subkey] = read_dataset(subitem)
             elif isinstance(item, h5py.Dataset):
-                data_dict[key] = np.array(item)
+                data_dict[key] = read_dataset(item)
 
         return data_dict, mat_file
 
@@ -132,6 +146,82 @@ def extract_mat_data_by_key(input_filename: Path, revised_scratch_path: Path):
         return data_dict, mat_file
 
 
+def read_dataset(dataset):
+    '''Reads an h5py.Dataset into a preallocated array with read_direct (no intermediate copy on chunked sources)'''
+    if dataset.dtype.kind == 'O' or dataset.size == 0: #OBJECT REFERENCES / EMPTY: REGULAR READ
+        return dataset[()]
+    out = np.empty(dataset.shape, dtype=dataset.dtype)
+    dataset.read_direct(out)
+    return out
+
+
+def read_contiguous(node):
+    '''Reads an h5py.Dataset (or array-like) once into a C-contiguous NumPy array; no copy if already contiguous'''
+    if isinstance(node, h5py.Dataset):
+        node = read_dataset(node)
+    return np.ascontiguousarray(node)
+
+
+class H5DatasetChunkIterator(GenericDataChunkIterator):
+    '''Streams an h5py.Dataset into an NWB write in buffers aligned to the source chunks (each source chunk is decompressed once),
+    filling each buffer with read_direct; the source file must stay open until the write completes'''
+
+    def __init__(self, dataset, **kwargs):
+        self.dataset = dataset
+        if 'chunk_shape' not in kwargs and 'chunk_mb' not in kwargs:
+            if dataset.chunks is not None:
+                kwargs['chunk_shape'] = dataset.chunks #ALIGN TO SOURCE CHUNKS
+            else:
+                kwargs['chunk_mb'] = 1.0 #CONTIGUOUS SOURCE: ~1 MiB HYPERCUBE
+        super().__init__(**kwargs)
+
+    def _get_data(self, selection):
+        out = np.empty([len(range(*sel.indices(dim))) for sel, dim in zip(selection, self.dataset.shape)], dtype=self.dataset.dtype)
+        self.dataset.read_direct(out, source_sel=selection)
+        return out
+
+    def _get_maxshape(self):
+        return self.dataset.shape
+
+    def _get_dtype(self):
+        return self.dataset.dtype
+
+
+def bulk_uuid4(count):
+    '''count random (version 4) UUIDs in canonical 36-char form (as str(uuid.uuid4())), drawn from a single os.urandom call'''
+    raw = np.frombuffer(os.urandom(16 * count), dtype=np.uint8).reshape(count, 16).copy()
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40 #VERSION 4
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80 #RFC 4122 VARIANT
+    data = raw.tobytes()
+    return [str(uuid.UUID(bytes=data[i:i + 16])) for i in range(0, 16 * count, 16)]
+
+
+def is_up_to_date(output_file, source_mtime, source_folder):
+    '''True if output_file exists and is at least as new as source_mtime and every (non-hidden) file in source_folder'''
+    try:
+        output_mtime = os.stat(output_file).st_mtime
+    except FileNotFoundError:
+        return False
+    if output_mtime < source_mtime:
+        return False
+    with os.scandir(source_folder) as entries:
+        return all(entry.stat().st_mtime <= output_mtime for entry in entries if not entry.name.startswith('.') and entry.is_file())
+
+
+def find_session_output(folder, session_prefix, suffix):
+    '''Newest existing output for a session in folder, or None; output names are <session_prefix>_<uuid4><suffix> and get a fresh uuid every run'''
+    name_length = len(session_prefix) + 1 + 36 + len(suffix) #EXACT LENGTH: SESSION '12' DOES NOT MATCH '12_3_<uuid>.nwb'
+    try:
+        with os.scandir(folder) as entries:
+            matches = [entry for entry in entries
+                       if len(entry.name) == name_length and entry.name.startswith(session_prefix + '_') and entry.name.endswith(suffix)]
+    except FileNotFoundError:
+        return None
+    if not matches:
+        return None
+    return Path(max(matches, key=lambda entry: entry.stat().st_mtime).path)
+
+
 def matstruct_to_dict(matobj):
     if isinstance(matobj, np.ndarray):
         return [matstruct_to_dict(o) for o in matobj]
@@ -0,0 +1,41 @@
+import importlib.util
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+#data-prep/ IS A SCRIPT FOLDER (NOT A PACKAGE); LOAD share.py BY PATH
+spec = importlib.util.spec_from_file_location('share', Path(__file__).parents[1] / 'data-prep' / 'share.py')
+share = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(share)
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('(2.0, 2.0, 30.0)', (2.0, 2.0, 30.0)),
+    ('[2, 2]', (2.0, 2.0)),
+    (' ( 0.5 ,1 ) ', (0.5, 1.0)),
+    ('(2.0, 2.0,)', (2.0, 2.0)), #TRAILING COMMA
+    ('3', (3.0,)),
+    (3.0, (3.0,)), #NUMERIC CELL
+])
+def test_parse_grid_spacing(value, expected):
+    assert share.parse_grid_spacing(value) == expected
+
+
+def test_parse_grid_spacing_rejects_text():
+    with pytest.raises(ValueError):
+        share.parse_grid_spacing('(2.0, n/a)')
+
+
+def test_normalize_subject_fields_ages():
+    records = pd.DataFrame({'age': ['P30D', 12, None, 'unknown', 5.0],
+                            'date_of_birth(YYYY-MM-DD)': [None] * 5})
+    ages = share.normalize_subject_fields(records)['age']
+    assert list(ages) == ['P30D', 'P12D', 'P0D', 'P0D', 'P5D'] #ISO 8601 AGES PASS THROUGH UNCHANGED
+
+
+def test_normalize_subject_fields_date_of_birth():
+    records = pd.DataFrame({'age': [1, 1], 'date_of_birth(YYYY-MM-DD)': ['2023-01-05 13:45', 'not a date']})
+    dates_of_birth = share.normalize_subject_fields(records)['date_of_birth(YYYY-MM-DD)']
+    assert dates_of_birth[0] == pd.Timestamp('2023-01-05', tz=share.local_tz) #LOCAL MIDNIGHT
+    assert dates_of_birth[1] is None
@@ -0,0 +1,141 @@
+import os
+import uuid
+
+import h5py
+import numpy as np
+import pytest
+
+from lib import utils
+
+
+@pytest.fixture
+def h5_file(tmp_path):
+    path = tmp_path / 'data.h5'
+    with h5py.File(path, 'w') as f:
+        f['scalar'] = np.float64(3.5)
+        f['empty'] = np.zeros((0, 3))
+        f['contiguous'] = np.arange(12, dtype='i2').reshape(3, 4)
+        f.create_dataset('chunked', data=np.arange(1000 * 6, dtype='i4').reshape(1000, 6), chunks=(64, 6))
+        f.create_dataset('strings', data=[b'x', b'yy'], dtype=h5py.string_dtype('ascii'))
+    with h5py.File(path, 'r') as f:
+        yield f
+
+
+def test_read_dataset_scalar(h5_file):
+    value = utils.read_dataset(h5_file['scalar'])
+    assert value.shape == ()
+    assert value == 3.5
+
+
+def test_read_dataset_empty(h5_file):
+    value = utils.read_dataset(h5_file['empty'])
+    assert value.shape == (0, 3)
+
+
+@pytest.mark.parametrize('name', ['contiguous', 'chunked'])
+def test_read_dataset_matches_regular_read(h5_file, name):
+    value = utils.read_dataset(h5_file[name])
+    assert value.dtype == h5_file[name].dtype
+    np.testing.assert_array_equal(value, h5_file[name][()])
+
+
+def test_read_dataset_object_dtype(h5_file):
+    value = utils.read_dataset(h5_file['strings'])
+    assert list(value) == [b'x', b'yy']
+
+
+def test_chunk_iterator_uses_source_chunks(h5_file):
+    iterator = utils.H5DatasetChunkIterator(h5_file['chunked'], buffer_shape=(128, 6))
+    assert iterator.chunk_shape == (64, 6)
+    assert iterator.maxshape == (1000, 6)
+    assert iterator.dtype == np.dtype('i4')
+
+
+def test_chunk_iterator_round_trip(h5_file):
+    source = h5_file['chunked']
+    out = np.zeros(source.shape, dtype=source.dtype)
+    for chunk in utils.H5DatasetChunkIterator(source, buffer_shape=(128, 6)):
+        assert chunk.selection[0].start % 64 == 0 #BUFFERS START ON SOURCE CHUNK BOUNDARIES
+        out[chunk.selection] = chunk.data
+    np.testing.assert_array_equal(out, source[()])
+
+
+def test_chunk_iterator_contiguous_source(h5_file):
+    source = h5_file['contiguous']
+    iterator = utils.H5DatasetChunkIterator(source)
+    out = np.zeros(source.shape, dtype=source.dtype)
+    for chunk in iterator:
+        out[chunk.selection] = chunk.data
+    np.testing.assert_array_equal(out, source[()])
+
+
+def test_bulk_uuid4_format():
+    identifiers = utils.bulk_uuid4(50)
+    assert len(identifiers) == 50
+    assert len(set(identifiers)) == 50
+    for identifier in identifiers:
+        parsed = uuid.UUID(identifier)
+        assert str(parsed) == identifier #CANONICAL 36-CHAR DASHED FORM, AS str(uuid.uuid4())
+        assert parsed.version == 4
+        assert parsed.variant == uuid.RFC_4122
+
+
+def test_bulk_uuid4_empty():
+    assert utils.bulk_uuid4(0) == []
+
+
+def touch(path, mtime):
+    path.write_bytes(b'')
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_find_session_output_exact_name(tmp_path):
+    session_uuid = str(uuid.uuid4())
+    expected = touch(tmp_path / f'12_{session_uuid}.nwb', 1000)
+    touch(tmp_path / f'12_3_{session_uuid}.nwb', 2000) #OTHER SESSION ('12_3') SHARING THE PREFIX
+    touch(tmp_path / f'12_{session_uuid}.nwb.tmp', 3000) #UNFINISHED WRITE
+    touch(tmp_path / f'12_{session_uuid}.zarr', 4000) #OTHER BACKEND
+    assert utils.find_session_output(tmp_path, '12', '.nwb') == expected
+
+
+def test_find_session_output_newest(tmp_path):
+    touch(tmp_path / f'12_{uuid.uuid4()}.nwb', 1000)
+    newest = touch(tmp_path / f'12_{uuid.uuid4()}.nwb', 2000)
+    assert utils.find_session_output(tmp_path, '12', '.nwb') == newest
+
+
+def test_find_session_output_missing(tmp_path):
+    assert utils.find_session_output(tmp_path, '12', '.nwb') is None
+    assert utils.find_session_output(tmp_path / 'absent', '12', '.nwb') is None
+
+
+def test_is_up_to_date(tmp_path):
+    source = tmp_path / 'source'
+    source.mkdir()
+    touch(source / 'session.mat', 1000)
+    output = touch(tmp_path / 'out.nwb', 2000)
+    assert utils.is_up_to_date(output, 1500, source)
+    assert utils.is_up_to_date(output, 2000, source) #EQUAL MTIMES COUNT AS UP TO DATE
+
+
+def test_is_up_to_date_stale(tmp_path):
+    source = tmp_path / 'source'
+    source.mkdir()
+    input_file = touch(source / 'session.mat', 1000)
+    output = touch(tmp_path / 'out.nwb', 2000)
+    assert not utils.is_up_to_date(output, 2500, source) #META-DATA SHEET NEWER
+    os.utime(input_file, (3000, 3000))
+    assert not utils.is_up_to_date(output, 1500, source) #INPUT FILE NEWER
+    assert not utils.is_up_to_date(tmp_path / 'absent.nwb', 0, source)
+
+
+def test_is_up_to_date_ignores_hidden_files_and_folders(tmp_path):
+    source = tmp_path / 'source'
+    source.mkdir()
+    touch(source / 'session.mat', 1000)
+    touch(source / '.DS_Store', 3000)
+    (source / 'subfolder').mkdir()
+    os.utime(source / 'subfolder', (3000, 3000))
+    output = touch(tmp_path / 'out.nwb', 2000)
+    assert utils.is_up_to_date(output, 1500, source)